@@ -3,11 +3,17 @@ coc2026.py - KELP COC Streamlit App v3
 - Date/time picker widgets (no manual typing)
 - Matrix-aware method display
 - Timezone selector
+- Saved analysis profiles (versioned; packages expanded) applied to one or all samples
+- Company-name type-ahead fills the client/project block from past COCs
 """
 import streamlit as st
-import datetime
+import datetime, os
+from coc_clients import ClientIndex, BLOCK_FIELDS
 from coc_catalog import KELP_ANALYTE_CATALOG, get_methods_flat, generate_coc_id
+from coc_ledger import CustodyLedger
 from coc_pdf_engine import generate_coc_pdf
+from coc_profiles import ProfileStore, expand_analyses, use_packages
+from coc_records import COCRecord, SampleRecord
 
 st.set_page_config(page_title="KELP COC Generator", layout="wide", page_icon="\U0001f4c4")
 st.title("\U0001f4c4 KELP Chain-of-Custody Generator")
@@ -19,32 +25,87 @@ MATRIX_LABELS = {
 }
 TZ_OPTIONS = ["PT", "AK", "MT", "CT", "ET"]
 COMP_GRAB = ["GRAB", "COMP"]
+LEDGER_PATH = os.environ.get("KELP_LEDGER", "kelp_custody.db")
+PROFILES_PATH = os.environ.get("KELP_PROFILES", "kelp_profiles.json")
+CLIENTS_PATH = os.environ.get("KELP_CLIENTS", "kelp_clients.db")
+
+
+@st.cache_resource
+def custody_ledger():
+    return CustodyLedger(LEDGER_PATH)
+
+
+@st.cache_resource
+def client_index():
+    return ClientIndex(CLIENTS_PATH)
+
+
+def fill_client(fields):
+    """Button callback: copy a past client/project block into the form."""
+    for f in BLOCK_FIELDS: st.session_state[f"ci_{f}"] = fields.get(f, "")
+
+
+@st.cache_resource
+def profile_store():
+    return ProfileStore(PROFILES_PATH)
+
+
+def apply_profile(name, version, indices):
+    """Button callback: set the analyte pickers of the given samples to a profile's compiled selection."""
+    sel = profile_store().get(name, version).selection_dict()
+    for i in indices:
+        for cn in KELP_ANALYTE_CATALOG:
+            st.session_state[f"a_{cn}_{i}"] = sel.get(cn, [])
+            st.session_state[f"all_{cn}_{i}"] = False
+        st.session_state[f"prof_{i}"] = (name, version)
+
+
+def save_profile(i):
+    """Button callback: store sample i's current analyses as the next version of the named profile."""
+    sel = {cn: st.session_state.get(f"a_{cn}_{i}") or [] for cn in KELP_ANALYTE_CATALOG}
+    try:
+        p = profile_store().save(st.session_state.get("prof_new_name", ""), sel, st.session_state.get("prof_new_desc", ""))
+        st.session_state["prof_msg"] = ("success", f"Saved profile **{p.label}**")
+    except ValueError as e:
+        st.session_state["prof_msg"] = ("error", str(e))
+
 
 # === CLIENT INFO ===
 st.header("1\ufe0f\u20e3 Client Information")
 c1, c2 = st.columns(2)
 with c1:
-    company_name = st.text_input("Company Name")
-    client_street = st.text_input("Street Address")
-    client_city_state_zip = st.text_input("City, State, ZIP")
-    customer_project = st.text_input("Customer Project #")
-    project_name = st.text_input("Project Name")
+    company_name = st.text_input("Company Name", key="ci_company_name")
+    matches = [m["fields"] for m in client_index().suggest(company_name)] if company_name.strip() else []
+    matches = [m for m in matches if any(m.get(f, "") != st.session_state.get(f"ci_{f}", "") for f in BLOCK_FIELDS)]
+    if matches:
+        mc1, mc2 = st.columns([3, 1])
+        with mc1:
+            pick = st.selectbox("Previous clients", range(len(matches)), key="ci_pick", label_visibility="collapsed",
+                                format_func=lambda j: " \u2014 ".join(v for v in (matches[j].get("company_name"),
+                                    matches[j].get("project_name"), matches[j].get("client_address"),
+                                    matches[j].get("contact_name")) if v))
+        with mc2:
+            st.button("Fill client & project", on_click=fill_client, args=(matches[pick],), use_container_width=True)
+    client_street = st.text_input("Street Address", key="ci_client_address")
+    client_city_state_zip = st.text_input("City, State, ZIP", key="ci_client_address_2")
+    customer_project = st.text_input("Customer Project #", key="ci_project_number")
+    project_name = st.text_input("Project Name", key="ci_project_name")
 with c2:
-    contact_name = st.text_input("Contact / Report To")
-    phone = st.text_input("Phone #")
-    email = st.text_input("E-Mail")
-    cc_email = st.text_input("Cc E-Mail")
-    invoice_to = st.text_input("Invoice To")
+    contact_name = st.text_input("Contact / Report To", key="ci_contact_name")
+    phone = st.text_input("Phone #", key="ci_phone")
+    email = st.text_input("E-Mail", key="ci_email")
+    cc_email = st.text_input("Cc E-Mail", key="ci_cc_email")
+    invoice_to = st.text_input("Invoice To", key="ci_invoice_to")
 
 st.header("2\ufe0f\u20e3 Project Details")
 c3, c4 = st.columns(2)
 with c3:
-    site_info = st.text_input("Site Collection Info / Facility ID")
-    county_state = st.text_input("County / State origin of sample(s)")
-    purchase_order = st.text_input("Purchase Order #")
-    quote_number = st.text_input("Quote #")
+    site_info = st.text_input("Site Collection Info / Facility ID", key="ci_site_info")
+    county_state = st.text_input("County / State origin of sample(s)", key="ci_county_state")
+    purchase_order = st.text_input("Purchase Order #", key="ci_purchase_order")
+    quote_number = st.text_input("Quote #", key="ci_quote_number")
 with c4:
-    invoice_email = st.text_input("Invoice E-mail")
+    invoice_email = st.text_input("Invoice E-mail", key="ci_invoice_email")
     container_size = st.selectbox("Container Size", ["500mL", "1L", "250mL", "125mL", "100mL", "Other"])
     preservative = st.selectbox("Preservative Type", [
         "None", "HNO3", "H2SO4", "HCl", "NaOH",
@@ -72,6 +133,24 @@ with c7:
 st.header("4\ufe0f\u20e3 Sample Information")
 num_samples = st.number_input("Number of Samples", 1, 10, 1)
 
+store = profile_store()
+use_packages(store.package_table())
+if store.invalid:
+    st.warning("Some saved profiles or package definitions no longer match the catalog and are hidden: " +
+               "; ".join(f"{n} v{v}: {why}" for n, v, why in store.invalid))
+pc1, pc2, pc3 = st.columns([3, 1, 1])
+with pc1:
+    prof_name = st.selectbox("Saved Analysis Profile", store.names(), index=None, placeholder="Choose a profile")
+with pc2:
+    prof_version = st.selectbox("Version", store.versions(prof_name)[::-1] if prof_name else [])
+with pc3:
+    st.button("Apply to all samples", on_click=apply_profile, args=(prof_name, prof_version, range(num_samples)),
+              disabled=not prof_name, use_container_width=True)
+if prof_name:
+    prof = store.get(prof_name, prof_version)
+    st.caption((prof.description + " \u2014 " if prof.description else "") +
+               "; ".join(f"{cn}: {', '.join(al)}" for cn, al in prof.analyses))
+
 samples = []
 for i in range(num_samples):
     st.subheader(f"Sample {i+1}")
@@ -85,6 +164,9 @@ for i in range(num_samples):
         comp_grab = st.selectbox("Comp/Grab", COMP_GRAB, key=f"cg_{i}")
     with sc4:
         num_containers = st.number_input("# Containers", 1, 20, 1, key=f"nc_{i}")
+    if prof_name:
+        st.button(f"Apply {prof.label} to sample {i+1}", key=f"ap_{i}",
+                  on_click=apply_profile, args=(prof_name, prof_version, [i]))
 
     # Date/time pickers
     dt1, dt2, dt3, dt4 = st.columns(4)
@@ -126,27 +208,34 @@ for i in range(num_samples):
             method_str = ", ".join(cat_info["methods"].get("potable", []))
         else:
             method_str = ", ".join(cat_info["methods"].get("nonpotable", []))
-        if cat_name != "Packages":
-            with st.expander(f"\U0001f9ea {cat_name}  \u2014  {method_str}", expanded=False):
-                sa = st.checkbox(f"Select all {cat_name}", key=f"all_{cat_name}_{i}", value=False)
-                sel = st.multiselect(f"Analytes", cat_info["analytes"],
-                    default=cat_info["analytes"] if sa else [], key=f"a_{cat_name}_{i}")
-                if sel: sample_analyses[cat_name] = sel
+        with st.expander(f"\U0001f9ea {cat_name}  \u2014  {method_str}", expanded=False):
+            sa = st.checkbox(f"Select all {cat_name}", key=f"all_{cat_name}_{i}", value=False)
+            sel = st.multiselect(f"Analytes", cat_info["analytes"],
+                default=cat_info["analytes"] if sa else None, key=f"a_{cat_name}_{i}")
+            if sel: sample_analyses[cat_name] = sel
+            if cat_name == "Packages":
+                for pkg in sel:
+                    pdef = store.package_table().get(pkg)
+                    st.caption(f"**{pkg}**: " + ("; ".join(f"{cn}: {', '.join(al)}" for cn, al in pdef) if pdef else
+                                                 "no definition stored yet — not expanded into analytes"))
 
     comment = st.text_input("Sample Comment", key=f"cmt_{i}")
 
-    samples.append({
-        "sample_id": sample_id, "matrix": matrix, "comp_grab": comp_grab,
-        "start_date": start_date.strftime("%m/%d/%Y") if start_date else "",
-        "start_time": start_time.strftime("%H:%M") if start_time else "",
-        "end_date": coll_date.strftime("%m/%d/%Y") if coll_date else "",
-        "end_time": coll_time.strftime("%H:%M") if coll_time else "",
-        "num_containers": str(num_containers), "analyses": sample_analyses,
-        "comment": comment,
-        "res_cl_result": res_cl_result, "res_cl_units": res_cl_units,
-    })
+    samples.append(SampleRecord(
+        sample_id=sample_id.strip(), matrix=matrix, comp_grab=comp_grab,
+        start_date=start_date.strftime("%m/%d/%Y") if start_date else "",
+        start_time=start_time.strftime("%H:%M") if start_time else "",
+        end_date=coll_date.strftime("%m/%d/%Y") if coll_date else "",
+        end_time=coll_time.strftime("%H:%M") if coll_time else "",
+        num_containers=str(num_containers),
+        analyses=tuple((cn, tuple(al)) for cn, al in sample_analyses.items()),
+        comment=comment.strip(),
+        res_cl_result=res_cl_result.strip(), res_cl_units=res_cl_units,
+    ))
 
     # Preview
+    if "Packages" in sample_analyses:
+        sample_analyses = {cn: list(al) for cn, al in expand_analyses(samples[-1].analyses)}
     if sample_analyses:
         with st.container():
             for cn, al in sample_analyses.items():
@@ -159,6 +248,19 @@ for i in range(num_samples):
     else:
         st.info("No analyses selected yet.")
 
+with st.expander("\U0001f4be Save a sample's analyses as a profile"):
+    sp1, sp2, sp3 = st.columns([2, 3, 1])
+    with sp1:
+        st.text_input("Profile Name", key="prof_new_name", help="Saving an existing name adds a new version")
+    with sp2:
+        st.text_input("Description", key="prof_new_desc")
+    with sp3:
+        save_from = st.selectbox("From Sample", range(num_samples), format_func=lambda i: f"Sample {i+1}")
+    st.button("Save Profile", on_click=save_profile, args=(save_from,))
+    if "prof_msg" in st.session_state:
+        kind, msg = st.session_state.pop("prof_msg")
+        (st.success if kind == "success" else st.error)(msg)
+
 # === BOTTOM FIELDS ===
 st.header("5\ufe0f\u20e3 Additional Information")
 ac1, ac2 = st.columns(2)
@@ -169,28 +271,40 @@ with ac2:
 
 # === GENERATE ===
 st.divider()
-if st.button("\U0001f4e4 Generate COC PDF", type="primary", use_container_width=True):
-    coc_data = {
-        "company_name": company_name, "client_address": client_street,
-        "client_address_2": client_city_state_zip,
-        "contact_name": contact_name, "phone": phone, "email": email, "cc_email": cc_email,
-        "project_number": customer_project, "project_name": project_name,
-        "invoice_to": invoice_to, "invoice_email": invoice_email,
-        "site_info": site_info, "county_state": county_state,
-        "purchase_order": purchase_order, "quote_number": quote_number,
-        "container_size": container_size, "preservative_type": preservative,
-        "time_zone": time_zone, "data_deliverable": data_deliverable,
-        "field_filtered": field_filtered, "reportable": reportable, "rush": rush,
-        "received_on_ice": received_on_ice, "delivery_method": delivery_method,
-        "additional_instructions": additional_instructions,
-        "customer_remarks": customer_remarks,
-        "samples": samples,
-    }
-    buf, coc_id = generate_coc_pdf(coc_data)
+if st.button("\U0001f4e4 Generate COC PDF", type="primary", use_container_width=True, key="generate"):
+    # Profile / Template: profiles applied to samples whose selection still matches them
+    applied = []
+    for i, s in enumerate(samples):
+        ref = st.session_state.get(f"prof_{i}")
+        if ref and ref[0] in store.names() and ref[1] in store.versions(ref[0]):
+            p = store.get(*ref)
+            if {cn: set(al) for cn, al in p.analyses} == {cn: set(al) for cn, al in expand_analyses(s.analyses)}:
+                applied.append(p.label)
+    coc_record = COCRecord(
+        company_name=company_name, client_address=client_street,
+        client_address_2=client_city_state_zip,
+        contact_name=contact_name, phone=phone, email=email, cc_email=cc_email,
+        project_number=customer_project, project_name=project_name,
+        invoice_to=invoice_to, invoice_email=invoice_email,
+        site_info=site_info, county_state=county_state,
+        purchase_order=purchase_order, quote_number=quote_number,
+        container_size=container_size, preservative_type=preservative,
+        time_zone=time_zone, data_deliverable=data_deliverable,
+        field_filtered=field_filtered, reportable=reportable, rush=rush,
+        received_on_ice=received_on_ice, delivery_method=delivery_method,
+        additional_instructions=additional_instructions,
+        customer_remarks=customer_remarks,
+        profile_template=", ".join(dict.fromkeys(applied)),
+        samples=tuple(samples),
+    )
+    buf, coc_id = generate_coc_pdf(coc_record)
+    pdf = buf.getvalue()
+    ledger = custody_ledger(); ledger.record_generated(coc_id, pdf); ledger.flush()
+    client_index().record(coc_record, coc_id)
     st.success(f"COC generated: **{coc_id}**")
     st.download_button(
         label="\U0001f4be Download COC PDF",
-        data=buf.getvalue(),
+        data=pdf,
         file_name=f"KELP_CoC_{coc_id}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
         mime="application/pdf",
         type="primary"
@@ -4,13 +4,18 @@ Matrix-aware methods + hybrid chemical symbols
 """
 import random, datetime
 
+CATALOG_VERSION = "5"
+
 # Methods keyed by matrix type: "potable" covers DW; "nonpotable" covers GW, WW, SW, P, OT
+# hold_hours: regulatory holding time from collection, same matrix keys (see ANALYTE_HOLD_HOURS);
+# Packages has none -- its entries expand (coc_profiles package definitions) to analytes that carry their own
 KELP_ANALYTE_CATALOG = {
     "Metals": {
         "methods": {
             "potable": ["EPA 200.8"],
             "nonpotable": ["EPA 6020B"],
         },
+        "hold_hours": {"potable": 4320, "nonpotable": 4320},
         "analytes": [
             "Aluminum","Antimony","Arsenic","Barium","Beryllium","Boron",
             "Cadmium","Calcium","Chromium","Chromium (VI)","Cobalt","Copper",
@@ -24,6 +29,7 @@ KELP_ANALYTE_CATALOG = {
             "potable": ["EPA 300.1"],
             "nonpotable": ["EPA 300.1"],
         },
+        "hold_hours": {"potable": 672, "nonpotable": 672},
         "analytes": [
             "Bromate","Bromide","Chlorate","Chloride","Chlorite",
             "Cyanide - Available","Cyanide - Total","Fluoride",
@@ -35,6 +41,7 @@ KELP_ANALYTE_CATALOG = {
             "potable": ["SM/EPA"],
             "nonpotable": ["SM/EPA"],
         },
+        "hold_hours": {"potable": 168, "nonpotable": 168},
         "analytes": [
             "pH","Temperature","Turbidity","Conductivity","Dissolved Oxygen",
             "Alkalinity","Hardness - Total","Total Dissolved Solids",
@@ -47,6 +54,7 @@ KELP_ANALYTE_CATALOG = {
             "potable": ["EPA 350/351/365"],
             "nonpotable": ["EPA 350/351/365"],
         },
+        "hold_hours": {"potable": 672, "nonpotable": 672},
         "analytes": [
             "Ammonia (as N)","Kjeldahl Nitrogen - Total",
             "Phosphorus - Total","Sulfide (as S)","Sulfite (as SO3)",
@@ -57,6 +65,7 @@ KELP_ANALYTE_CATALOG = {
             "potable": ["EPA 415/SM5540"],
             "nonpotable": ["EPA 415/SM5540"],
         },
+        "hold_hours": {"potable": 672, "nonpotable": 672},
         "analytes": ["Dissolved Organic Carbon","Total Organic Carbon","Surfactants (MBAS)"],
     },
     "PFAS Testing": {
@@ -64,6 +73,7 @@ KELP_ANALYTE_CATALOG = {
             "potable": ["EPA 537.1"],
             "nonpotable": ["EPA 1633A"],
         },
+        "hold_hours": {"potable": 336, "nonpotable": 672},
         "analytes": [
             "PFAS 3-Compound (PFNA, PFOA, PFOS)","PFAS 14-Compound",
             "PFAS 18-Compound","PFAS 25-Compound","PFAS 40-Compound",
@@ -74,6 +84,7 @@ KELP_ANALYTE_CATALOG = {
             "potable": ["SM 4500-Cl"],
             "nonpotable": ["SM 4500-Cl"],
         },
+        "hold_hours": {"potable": 0.25, "nonpotable": 0.25},
         "analytes": [
             "Chlorine - Free","Chlorine - Free (DPD)","Chlorine - Total (DPD)",
             "Chlorine - Combined","Chloramines (Monochloramine)","Chlorine Dioxide",
@@ -146,6 +157,23 @@ SYMBOL_MAP = {
     "Surfactants (MBAS)": "MBAS",
 }
 
+# Analytes whose holding time differs from their category's hold_hours (hours; 0.25 = analyze immediately)
+ANALYTE_HOLD_HOURS = {
+    # Metals
+    "Mercury": 672, "Chromium (VI)": 24,
+    # Inorganics
+    "Nitrate": 48, "Nitrite": 48, "Phosphate - Ortho": 48, "Chlorite": 336,
+    "Cyanide - Available": 336, "Cyanide - Total": 336,
+    # Phys/Gen Chem
+    "pH": 0.25, "Temperature": 0.25, "Dissolved Oxygen": 0.25, "Turbidity": 48,
+    "Conductivity": 672, "Alkalinity": 336, "Hardness - Total": 4320,
+    "BOD (5-day)": 48, "BOD - Carbonaceous": 48, "Chemical Oxygen Demand": 672,
+    # Nutrients
+    "Sulfide (as S)": 168, "Sulfite (as SO3)": 0.25,
+    # Organics
+    "Surfactants (MBAS)": 48,
+}
+
 def to_symbol(analyte_name):
     """Convert analyte name to hybrid symbol if available."""
     return SYMBOL_MAP.get(analyte_name, analyte_name)
@@ -186,6 +214,20 @@ def get_methods_for_category(cat_name, matrices):
     return ", ".join(methods)
 
 
+def get_hold_hours(cat_name, analyte=None, matrix=None):
+    """Holding time in hours for an analyte (or the category default).
+
+    Potable (DW) matrices use the potable hold; anything else uses nonpotable.
+    Returns None for unknown categories and for Packages (expand them first).
+    """
+    if analyte in ANALYTE_HOLD_HOURS:
+        return ANALYTE_HOLD_HOURS[analyte]
+    hinfo = KELP_ANALYTE_CATALOG.get(cat_name, {}).get("hold_hours")
+    if hinfo is None:
+        return None
+    return hinfo["potable" if matrix in POTABLE_MATRICES else "nonpotable"]
+
+
 def get_methods_flat(cat_name):
     """Get all unique methods for a category (for display in Streamlit)."""
     if cat_name not in KELP_ANALYTE_CATALOG:
@@ -0,0 +1,131 @@
+"""
+coc_clients.py - KELP client/project autocomplete index v1
+
+- Local SQLite index of client + project blocks from previously generated coc_data
+- Prefix lookup on company name (and on each word of it) over a B-tree term table
+- record() updates the index incrementally on every generate; build from old PDFs once
+
+Usage: python coc_clients.py INDEX build DIR      (index payloads embedded in PDFs under DIR)
+       python coc_clients.py INDEX suggest PREFIX
+"""
+import argparse, datetime, json, os, sqlite3, threading
+
+from coc_records import as_record
+
+CLIENT_FIELDS = ("company_name", "client_address", "client_address_2", "client_address_3", "contact_name",
+                 "phone", "email", "cc_email", "invoice_to", "invoice_email")
+PROJECT_FIELDS = ("project_number", "project_name", "site_info", "county_state", "purchase_order", "quote_number")
+BLOCK_FIELDS = CLIENT_FIELDS + PROJECT_FIELDS
+# a block is one client at one project; PO, quote and site details take the latest values seen
+KEY_FIELDS = CLIENT_FIELDS + ("project_number", "project_name")
+_SCAN_SWITCH = 256  # prefixes matching at least this many terms are served by a rank-ordered scan
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY, block TEXT NOT NULL UNIQUE, fields TEXT NOT NULL,
+                                   uses INTEGER NOT NULL, last_used TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS blocks_rank ON blocks (uses DESC, last_used DESC);
+CREATE TABLE IF NOT EXISTS terms (term TEXT, block_id INTEGER, PRIMARY KEY (term, block_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS terms_block ON terms (block_id, term);
+CREATE TABLE IF NOT EXISTS seen (coc_id TEXT PRIMARY KEY) WITHOUT ROWID;
+"""
+
+
+def _norm(s):
+    return " ".join(s.casefold().split())
+
+def _terms(company):
+    """The normalized name and every word-suffix of it, so 'water' finds 'Acme Water District'."""
+    words = _norm(company).split()
+    return {" ".join(words[i:]) for i in range(len(words))}
+
+
+class ClientIndex:
+    def __init__(self, path="kelp_clients.db"):
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL"); self.db.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _record(self, cur, data, coc_id, when):
+        rec = as_record(data)
+        if not rec.company_name: return False
+        if coc_id and cur.execute("INSERT OR IGNORE INTO seen VALUES (?)", (coc_id,)).rowcount == 0: return False
+        fields = {f: getattr(rec, f) for f in BLOCK_FIELDS if getattr(rec, f)}
+        block = json.dumps([_norm(getattr(rec, f)) for f in KEY_FIELDS], separators=(",", ":"))
+        cur.execute("INSERT INTO blocks (block, fields, uses, last_used) VALUES (?,?,1,?) "
+                    "ON CONFLICT (block) DO UPDATE SET uses=uses+1, last_used=MAX(last_used, excluded.last_used), "
+                    "fields=CASE WHEN excluded.last_used >= last_used THEN excluded.fields ELSE fields END",
+                    (block, json.dumps(fields, separators=(",", ":")), when))
+        bid = cur.execute("SELECT id FROM blocks WHERE block=?", (block,)).fetchone()[0]
+        cur.executemany("INSERT OR IGNORE INTO terms VALUES (?,?)", [(t, bid) for t in _terms(rec.company_name)])
+        return True
+
+    def record(self, data, coc_id="", when=None):
+        """Add one generated COC (record or coc_data dict). A coc_id already indexed is skipped.
+        Returns True if the index changed."""
+        when = when or datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            cur = self.db.cursor(); cur.execute("BEGIN IMMEDIATE")
+            try: changed = self._record(cur, data, coc_id, when); cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK"); raise
+        return changed
+
+    def build(self, directory):
+        """Index the coc_data embedded in every PDF under directory (one transaction). Returns count added."""
+        from coc_payload import scan_directory
+        n = 0
+        with self._lock:
+            cur = self.db.cursor(); cur.execute("BEGIN IMMEDIATE")
+            try:
+                for fp, p in scan_directory(directory):
+                    when = datetime.datetime.fromtimestamp(os.path.getmtime(fp)).isoformat(timespec="seconds")
+                    try: n += self._record(cur, p.get("data") or {}, p.get("coc_id", ""), when)
+                    except ValueError: continue  # payloads that no longer validate are skipped
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK"); raise
+        return n
+
+    def suggest(self, prefix, limit=8):
+        """Blocks whose company name (or a word in it) starts with prefix, most used first.
+        Returns [{"fields": {...}, "uses": n, "last_used": iso}]."""
+        p = _norm(prefix)
+        if not p: return []
+        lo, hi = p, p + "\U0010ffff"
+        few = self.db.execute("SELECT COUNT(*) FROM (SELECT 1 FROM terms WHERE term >= ? AND term < ? LIMIT ?)",
+                              (lo, hi, _SCAN_SWITCH)).fetchone()[0] < _SCAN_SWITCH
+        if few:  # rare prefix: rank the handful of matches
+            sql = ("SELECT fields, uses, last_used FROM blocks WHERE id IN "
+                   "(SELECT block_id FROM terms WHERE term >= ? AND term < ?) ORDER BY uses DESC, last_used DESC LIMIT ?")
+        else:    # common prefix: walk blocks in rank order and stop at the first `limit` that match
+            sql = ("SELECT fields, uses, last_used FROM blocks INDEXED BY blocks_rank WHERE EXISTS "
+                   "(SELECT 1 FROM terms WHERE block_id = blocks.id AND term >= ? AND term < ?) "
+                   "ORDER BY uses DESC, last_used DESC LIMIT ?")
+        rows = self.db.execute(sql, (lo, hi, limit))
+        return [{"fields": json.loads(f), "uses": u, "last_used": lu} for f, u, lu in rows]
+
+    def best(self, prefix):
+        """Fields of the top suggestion, or {}."""
+        s = self.suggest(prefix, 1)
+        return s[0]["fields"] if s else {}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="KELP client/project autocomplete index.")
+    ap.add_argument("index"); sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("build").add_argument("directory")
+    sub.add_parser("suggest").add_argument("prefix")
+    a = ap.parse_args()
+    with ClientIndex(a.index) as idx:
+        if a.cmd == "build": print("indexed %d COCs" % idx.build(a.directory))
+        else:
+            for s in idx.suggest(a.prefix): print(json.dumps(s, separators=(",", ":")))
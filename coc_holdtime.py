@@ -0,0 +1,155 @@
+"""
+coc_holdtime.py - KELP holding-time scheduler v1
+
+- Collection date/time + COC time zone normalized to UTC (DST-aware)
+- Expiry for every sample/analysis pair from catalog hold_hours, computed column-wise per COC
+- Heap-ordered queue across all open COCs: most urgent work in O(log n)
+"""
+import datetime, heapq, itertools
+from zoneinfo import ZoneInfo
+
+from coc_catalog import get_hold_hours, get_methods_for_category
+from coc_profiles import expand_analyses
+from coc_records import as_record
+
+# COC time-zone checkboxes -> IANA zones (DST handled by zoneinfo)
+TZ_ZONES = {
+    "AK": ZoneInfo("America/Anchorage"), "PT": ZoneInfo("America/Los_Angeles"),
+    "MT": ZoneInfo("America/Denver"), "CT": ZoneInfo("America/Chicago"),
+    "ET": ZoneInfo("America/New_York"),
+}
+UTC = datetime.timezone.utc
+
+
+def collection_utc(date_str, time_str="", tz="PT"):
+    """Parse COC MM/DD/YYYY + HH:MM in zone tz to an aware UTC datetime.
+    A missing time counts as 00:00 (the conservative start). Returns None without a date."""
+    if not date_str: return None
+    dt = datetime.datetime.strptime(date_str.strip(), "%m/%d/%Y")
+    if time_str:
+        t = datetime.datetime.strptime(time_str.strip(), "%H:%M")
+        dt = dt.replace(hour=t.hour, minute=t.minute)
+    return dt.replace(tzinfo=TZ_ZONES.get(tz, TZ_ZONES["PT"])).astimezone(UTC)
+
+
+def hold_pairs(data, coc_id=None):
+    """Yield one work item per sample x category x distinct hold time.
+
+    data is a COCRecord or coc_data dict. coc_id overrides data's own coc_id
+    (an embedded payload keeps it at payload["coc_id"], outside "data");
+    ValueError if neither is set. Composites start their clock at the
+    composite end (end_date/end_time). Packages are expanded into the analytes
+    they cover, which then carry their own hold times.
+    Items are dicts with collected_utc/expires_utc as epoch seconds.
+    """
+    rec = as_record(data); coc_id = coc_id or rec.coc_id; tz = rec.time_zone
+    if not coc_id: raise ValueError("hold-time items need a coc_id")
+    # column-wise: gather (collection key, hold hours) first, then parse each distinct key once
+    rows = []
+    for si, s in enumerate(rec.samples):
+        key = (s.end_date, s.end_time)
+        for cat, al in expand_analyses(s.analyses):
+            if cat == "Packages": continue
+            groups = {}
+            for a in al:
+                h = get_hold_hours(cat, a, s.matrix)
+                if h is not None: groups.setdefault(h, []).append(a)
+            for h, analytes in groups.items():
+                rows.append((key, h, si, s.sample_id, s.matrix, cat, analytes))
+    starts = {}
+    for key in {r[0] for r in rows}:
+        t0 = collection_utc(key[0], key[1], tz)
+        starts[key] = t0.timestamp() if t0 else None
+    t0s = [starts[r[0]] for r in rows]
+    expiries = [None if t0 is None else t0 + r[1]*3600.0 for t0, r in zip(t0s, rows)]
+    for r, t0, exp in zip(rows, t0s, expiries):
+        _, h, si, sid, matrix, cat, analytes = r
+        yield {"coc_id": coc_id, "sample_index": si, "sample_id": sid, "matrix": matrix,
+               "category": cat, "method": get_methods_for_category(cat, {matrix} if matrix else set()),
+               "analytes": analytes, "hold_hours": h, "collected_utc": t0, "expires_utc": exp}
+
+
+class HoldQueue:
+    """Priority queue of open sample/analysis work ordered by holding-time expiry.
+
+    Completing an item or closing a COC is O(1); stale heap entries are
+    discarded lazily as they reach the top. Only queued keys are tracked, so
+    nothing is kept for a COC once its items are popped, completed or closed.
+    """
+
+    def __init__(self):
+        self._heap = []; self._seq = itertools.count()
+        self._live = {}    # coc_id -> keys still queued (not popped, completed or closed)
+        self._heaped = {}  # coc_id -> heap entries, live or stale
+        self.unscheduled = []  # items without a collection date
+
+    def __len__(self):
+        return sum(map(len, self._live.values()))
+
+    @staticmethod
+    def _key(item):
+        return (item["coc_id"], item["sample_index"], item["category"], item["hold_hours"])
+
+    def _stale(self, item):
+        return self._key(item) not in self._live.get(item["coc_id"], ())
+
+    def _heappop(self):
+        item = heapq.heappop(self._heap)[2]; c = item["coc_id"]
+        self._heaped[c] -= 1
+        if not self._heaped[c]: del self._heaped[c]
+        return item
+
+    def add_coc(self, data, coc_id=None):
+        """Queue every pair on a COC (coc_id as for hold_pairs), replacing anything
+        already queued for it (e.g. an amended COC). Returns the number of items scheduled."""
+        data = as_record(data); coc_id = coc_id or data.coc_id
+        if not coc_id: raise ValueError("hold-time items need a coc_id")
+        self.close_coc(coc_id)
+        if coc_id in self._heaped:
+            # drop the old entries before they come back to life
+            self._heap = [e for e in self._heap if e[2]["coc_id"] != coc_id]; heapq.heapify(self._heap)
+            del self._heaped[coc_id]
+        live = set()
+        for item in hold_pairs(data, coc_id):
+            if item["expires_utc"] is None: self.unscheduled.append(item); continue
+            heapq.heappush(self._heap, (item["expires_utc"], next(self._seq), item)); live.add(self._key(item))
+        if live: self._live[coc_id] = live; self._heaped[coc_id] = len(live)
+        return len(live)
+
+    def _prune(self):
+        while self._heap and self._stale(self._heap[0][2]): self._heappop()
+
+    def peek(self):
+        """Most urgent open item, or None."""
+        self._prune()
+        return self._heap[0][2] if self._heap else None
+
+    def pop(self):
+        """Remove and return the most urgent open item, or None."""
+        self._prune()
+        if not self._heap: return None
+        item = self._heappop(); self._drop(item)
+        return item
+
+    def _drop(self, item):
+        live = self._live.get(item["coc_id"])
+        if live is None or self._key(item) not in live: return
+        live.discard(self._key(item))
+        if not live: del self._live[item["coc_id"]]
+
+    def complete(self, item):
+        """Mark a queued item as analyzed without popping it. Items already popped,
+        completed or closed, and unscheduled items, are ignored."""
+        if item.get("expires_utc") is None: return
+        self._drop(item)
+
+    def close_coc(self, coc_id):
+        """Drop every remaining item for coc_id, unscheduled ones included."""
+        self._live.pop(coc_id, None)
+        if any(i["coc_id"] == coc_id for i in self.unscheduled):
+            self.unscheduled = [i for i in self.unscheduled if i["coc_id"] != coc_id]
+
+    def due_before(self, when_utc):
+        """Open items expiring before when_utc (aware datetime or epoch seconds), most urgent first."""
+        cutoff = when_utc.timestamp() if isinstance(when_utc, datetime.datetime) else when_utc
+        return [e[2] for e in sorted(e for e in self._heap if e[0] < cutoff) if not self._stale(e[2])]
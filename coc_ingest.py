@@ -0,0 +1,265 @@
+"""
+coc_ingest.py - KELP watch-folder ingestion daemon v1
+
+- Polls an inbox for JSON/CSV order files and renders them on a process pool
+- Debounce: a file is picked up only after its size/mtime stop changing
+- Append-only journal checkpoints every file; restarts resume without re-rendering
+- Periodic steady-state throughput report (files/s, samples/s, render latency)
+- Optional custody ledger: each rendered PDF's hash is appended, one batch per poll
+
+Usage: python coc_ingest.py INBOX OUTBOX [--workers N] [--interval S] [--settle S] [--ledger FILE]
+"""
+import argparse, collections, concurrent.futures, csv, dataclasses, hashlib, json, logging, os, signal, time
+
+from coc_catalog import KELP_ANALYTE_CATALOG, CAT_SHORT_MAP, generate_coc_id
+from coc_ledger import CustodyLedger
+from coc_pdf_engine import generate_coc_pdf, MAX_SAMPLE_ROWS
+from coc_records import COCRecord, SampleRecord
+
+log = logging.getLogger("coc_ingest")
+
+ORDER_SUFFIXES = (".json", ".csv")
+SAMPLE_FIELDS = {f.name for f in dataclasses.fields(SampleRecord)} - {"analyses"} | {"collected_date", "collected_time"}
+_CATEGORY_COLUMNS = {**{k: k for k in KELP_ANALYTE_CATALOG}, **{v: k for k, v in CAT_SHORT_MAP.items()}}
+
+
+# === Order parsing ===
+
+def _orders_from_csv(f):
+    """One CSV = one COC. Each row is a sample; columns named after a catalog category
+    (full or short name) hold ';'-separated analytes; any other column is COC-level
+    and taken from the first row that fills it."""
+    coc = {}; samples = []
+    for row in csv.DictReader(f):
+        s = {}; analyses = {}
+        for k, v in row.items():
+            if k is None: continue
+            k = k.strip(); v = (v or "").strip()
+            if k in _CATEGORY_COLUMNS:
+                al = [a.strip() for a in v.split(";") if a.strip()]
+                if al: analyses[_CATEGORY_COLUMNS[k]] = al
+            elif k in SAMPLE_FIELDS: s[k] = v
+            elif v and not coc.get(k): coc[k] = v
+        if any(s.values()) or analyses:
+            s["analyses"] = analyses; samples.append(s)
+    coc["samples"] = samples
+    return [coc]
+
+
+def load_orders(path):
+    """Parse and validate an order file into COCRecords (a JSON file may hold one order or a list).
+    Raises ValueError (incl. COCValidationError) so bad files never reach the pool."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.lower().endswith(".csv"): orders = _orders_from_csv(f)
+        else:
+            doc = json.load(f); orders = doc if isinstance(doc, list) else [doc]
+    records = [COCRecord.from_dict(o) for o in orders]
+    for r in records:
+        if len(r.samples) > MAX_SAMPLE_ROWS:
+            raise ValueError("%d samples on one order; the COC holds %d" % (len(r.samples), MAX_SAMPLE_ROWS))
+    return records
+
+
+def _output_path(outbox, coc_id):
+    return os.path.join(outbox, "KELP_CoC_" + coc_id + ".pdf")
+
+
+def _render(order, outbox, overwrite=False):
+    """Worker: render one order and atomically write the PDF.
+    Unless overwrite (a resumed claim replacing its own output), the name is first
+    created with O_EXCL, so an existing PDF is never replaced (FileExistsError).
+    Returns (coc_id, path, samples, seconds, sha256, length)."""
+    t = time.perf_counter()
+    buf, coc_id = generate_coc_pdf(order); pdf = buf.getvalue()
+    dst = _output_path(outbox, coc_id); tmp = dst + ".part"
+    if not overwrite: os.close(os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    with open(tmp, "wb") as f: f.write(pdf)
+    os.replace(tmp, dst)
+    return coc_id, dst, len(order.samples), time.perf_counter() - t, hashlib.sha256(pdf).hexdigest(), len(pdf)
+
+
+# === Journal ===
+
+class Journal:
+    """Append-only JSONL checkpoint. One "claim" record (with the COC IDs assigned)
+    precedes rendering; one "done" or "error" record follows it."""
+
+    def __init__(self, path):
+        self.path = path; self.state = {}
+        self.ids = set()  # every COC ID ever claimed here
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for ln in f:
+                    try: rec = json.loads(ln)
+                    except ValueError: continue  # torn final line after a crash
+                    self.state[(rec["file"], tuple(rec["sig"]))] = rec; self.ids.update(rec.get("coc_ids", ()))
+        self._f = open(path, "a", encoding="utf-8")
+        if self._f.tell():
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n": self._f.write("\n")  # terminate a torn tail
+
+    def get(self, name, sig):
+        return self.state.get((name, tuple(sig)))
+
+    def write(self, rec):
+        self.state[(rec["file"], tuple(rec["sig"]))] = rec; self.ids.update(rec.get("coc_ids", ()))
+        self._f.write(json.dumps(rec, separators=(",", ":")) + "\n"); self._f.flush(); os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+
+# === Daemon ===
+
+class IngestDaemon:
+    def __init__(self, inbox, outbox, workers=None, interval=1.0, settle=2.0, report_every=60.0, journal=None, ledger=None):
+        self.inbox = inbox; self.outbox = outbox; self.interval = interval; self.settle = settle
+        self.report_every = report_every
+        self.orders_dir = os.path.join(outbox, "orders"); self.error_dir = os.path.join(outbox, "error")
+        for d in (outbox, self.orders_dir, self.error_dir): os.makedirs(d, exist_ok=True)
+        self.journal = Journal(journal or os.path.join(outbox, ".ingest_journal.jsonl"))
+        self.ledger = CustodyLedger(ledger) if isinstance(ledger, str) else ledger
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self._seen = {}      # name -> (sig, first time sig was observed)
+        self._inflight = {}  # name -> (sig, [futures], coc_ids)
+        self._window = collections.deque()  # (t_done, samples, render_s)
+        self._last_report = time.monotonic(); self._stop = False
+
+    def stop(self, *_):
+        self._stop = True
+
+    def _stable(self, now):
+        """Names whose size/mtime have been unchanged for at least `settle` seconds."""
+        ready = []; present = set()
+        with os.scandir(self.inbox) as it:
+            for e in it:
+                n = e.name
+                if not e.is_file() or n.startswith(".") or not n.lower().endswith(ORDER_SUFFIXES): continue
+                st = e.stat(); sig = (st.st_size, st.st_mtime_ns); present.add(n)
+                prev = self._seen.get(n)
+                if prev is None or prev[0] != sig: self._seen[n] = (sig, now); continue
+                if now - prev[1] >= self.settle and n not in self._inflight: ready.append((n, sig))
+        for n in set(self._seen) - present: del self._seen[n]
+        return sorted(ready)
+
+    def _finish(self, name, dest_dir, sig, ids=()):
+        """Move the order into dest_dir without replacing an earlier order of the same name:
+        a clash gets the first COC ID (or the file's mtime) and then a counter appended.
+        Linking fails on an existing name, like _render's O_EXCL."""
+        src = os.path.join(self.inbox, name)
+        if os.path.exists(src):
+            stem, ext = os.path.splitext(name); tag = ids[0] if ids else str(sig[1]); n = 0
+            while True:
+                dst = name if n == 0 else "%s_%s%s%s" % (stem, tag, "" if n == 1 else "_%d" % n, ext)
+                try: os.link(src, os.path.join(dest_dir, dst)); break
+                except FileExistsError: n += 1
+            os.unlink(src)
+            if n: log.info("archived %s as %s", name, dst)
+        self._seen.pop(name, None)
+
+    def _submit(self, name, sig):
+        rec = self.journal.get(name, sig)
+        if rec and rec["status"] == "done": self._finish(name, self.orders_dir, sig, rec.get("coc_ids", ())); return
+        if rec and rec["status"] == "error": self._finish(name, self.error_dir, sig, rec.get("coc_ids", ())); return
+        try: orders = load_orders(os.path.join(self.inbox, name))
+        except Exception as e:  # any unreadable or invalid order goes to error/; the daemon keeps polling
+            log.warning("rejecting %s: %s", name, e)
+            self.journal.write({"file": name, "sig": sig, "status": "error", "error": str(e)})
+            self._finish(name, self.error_dir, sig); return
+        # reuse the COC IDs claimed before a crash so a resumed render is identical
+        ids = rec.get("coc_ids", []) if rec else []
+        resumed = len(ids) == len(orders) and len(set(ids)) == len(ids)
+        if not resumed:
+            try: ids = self._reserve_ids(orders)
+            except ValueError as e:
+                log.warning("rejecting %s: %s", name, e)
+                self.journal.write({"file": name, "sig": sig, "status": "error", "error": str(e)})
+                self._finish(name, self.error_dir, sig); return
+            self.journal.write({"file": name, "sig": sig, "status": "claim", "coc_ids": ids})
+        futs = [self.pool.submit(_render, dataclasses.replace(o, coc_id=cid), self.outbox, resumed)
+                for o, cid in zip(orders, ids)]
+        self._inflight[name] = (sig, futs, ids)
+
+    def _reserve_ids(self, orders, attempts=1000):
+        """One COC ID per order, distinct within the batch and from every ID in the
+        journal or already rendered to the outbox. An order's own coc_id must be unused."""
+        ids = []; taken = self.journal.ids
+        used = lambda cid: cid in taken or cid in ids or os.path.exists(_output_path(self.outbox, cid))
+        for o in orders:
+            if o.coc_id:
+                if used(o.coc_id): raise ValueError("COC ID %s was already issued" % o.coc_id)
+                ids.append(o.coc_id); continue
+            for _ in range(attempts):
+                cid = generate_coc_id()
+                if not used(cid): break
+            else: raise ValueError("no unused COC ID after %d attempts" % attempts)
+            ids.append(cid)
+        return ids
+
+    def _collect(self, now):
+        done = []
+        for name in [n for n, (_, futs, _) in self._inflight.items() if all(f.done() for f in futs)]:
+            sig, futs, ids = self._inflight.pop(name)
+            try: results = [f.result() for f in futs]
+            except Exception as e:
+                log.error("render failed for %s: %r", name, e)
+                self.journal.write({"file": name, "sig": sig, "status": "error", "coc_ids": ids, "error": repr(e)})
+                self._finish(name, self.error_dir, sig, ids); continue
+            done.append((name, sig, ids, results))
+        if self.ledger and done:
+            # one ledger transaction per poll, committed before the journal marks the files done
+            for *_, results in done:
+                for r in results: self.ledger.record_digest(r[0], r[4], r[5])
+            self.ledger.flush()
+        for name, sig, ids, results in done:
+            self.journal.write({"file": name, "sig": sig, "status": "done", "coc_ids": ids,
+                                "outputs": [os.path.basename(r[1]) for r in results]})
+            self._finish(name, self.orders_dir, sig, ids)
+            for r in results: self._window.append((now, r[2], r[3]))
+            log.info("%s -> %s", name, ", ".join(ids))
+
+    def report(self, now=None):
+        """Throughput over the last report window: dict of files/s, samples/s, mean and max render ms."""
+        now = time.monotonic() if now is None else now
+        while self._window and now - self._window[0][0] > self.report_every: self._window.popleft()
+        w = self._window; span = self.report_every
+        secs = [x[2] for x in w]
+        return {"pdfs_per_s": len(w)/span, "samples_per_s": sum(x[1] for x in w)/span,
+                "render_ms_mean": 1000*sum(secs)/len(secs) if secs else 0.0,
+                "render_ms_max": 1000*max(secs) if secs else 0.0, "in_flight": len(self._inflight)}
+
+    def run_once(self, now=None):
+        now = time.monotonic() if now is None else now
+        for name, sig in self._stable(now): self._submit(name, sig)
+        self._collect(now)
+        if now - self._last_report >= self.report_every:
+            self._last_report = now; r = self.report(now)
+            log.info("throughput: %.2f PDF/s, %.1f samples/s, render %.0f ms mean / %.0f ms max, %d in flight",
+                     r["pdfs_per_s"], r["samples_per_s"], r["render_ms_mean"], r["render_ms_max"], r["in_flight"])
+
+    def run_forever(self):
+        try:
+            while not self._stop:
+                self.run_once(); time.sleep(self.interval)
+            # drain: let running renders land in the journal before exiting
+            for _, futs, _ in list(self._inflight.values()): concurrent.futures.wait(futs)
+            self._collect(time.monotonic())
+        finally:
+            self.pool.shutdown(); self.journal.close()
+            if self.ledger: self.ledger.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Watch INBOX for COC orders and render PDFs into OUTBOX.")
+    ap.add_argument("inbox"); ap.add_argument("outbox")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--interval", type=float, default=1.0, help="poll interval, seconds")
+    ap.add_argument("--settle", type=float, default=2.0, help="seconds a file must be unchanged before pickup")
+    ap.add_argument("--report-every", type=float, default=60.0)
+    ap.add_argument("--ledger", default=None, help="custody ledger file to record each rendered PDF's hash in")
+    a = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    daemon = IngestDaemon(a.inbox, a.outbox, a.workers, a.interval, a.settle, a.report_every, ledger=a.ledger)
+    signal.signal(signal.SIGTERM, daemon.stop); signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run_forever()
@@ -0,0 +1,232 @@
+"""
+coc_kitprep.py - KELP kit-prep aggregation v1
+
+- One streaming pass over coc_data (dicts or COCRecords); memory grows with the number
+  of distinct groups, never with the number of COCs
+- Containers by size/preservative, analyses by method (matrix-resolved), samples by matrix,
+  per event and across all events
+- Output as CSV rows or a summary PDF drawn with the COC engine's primitives
+
+Usage: python coc_kitprep.py SOURCE... [--event FIELD] [--csv OUT] [--pdf OUT]
+SOURCE: a directory of generated PDFs (embedded payloads), a .jsonl file (coc_data or
+payload per line), or a .json order file (one order or a list)
+"""
+import argparse, collections, csv, datetime, functools, io, json, os, sys
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.colors import black
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from coc_catalog import get_methods_for_category
+from coc_pdf_engine import (PW, PH, LM, RM, TM, BM, KELP_BLUE, ROW_SHADE, SECTION_BG, LW_OUTER, FS_TITLE,
+                            R, GRID, SHADE, TEXTS, SECTION_LABEL)
+from coc_profiles import expand_analyses
+from coc_records import COCRecord, as_record
+
+ALL_EVENTS = "All events"
+UNSPECIFIED = "Unspecified"
+CSV_HEADER = ("event", "section", "item", "detail", "samples", "quantity")
+MAX_REJECTS = 20  # rejected-record messages kept for the report; the count is always exact
+
+
+@functools.lru_cache(maxsize=None)
+def _method(cat, matrix):
+    """Method string for one category at one matrix (potable/nonpotable resolution)."""
+    return get_methods_for_category(cat, {matrix} if matrix else set()) or cat
+
+def _bottles(n):
+    """Containers for one sample; a blank or unreadable count means the one bottle every sample needs."""
+    try: return max(int(n), 0)
+    except ValueError: return 1
+
+
+class EventTotals:
+    __slots__ = ("cocs", "samples", "containers", "methods", "matrices")
+
+    def __init__(self):
+        self.cocs = 0; self.samples = 0
+        self.containers = collections.Counter()  # (size, preservative) -> containers
+        self.methods = {}                        # method -> [samples, analyte determinations]
+        self.matrices = collections.Counter()    # matrix -> samples
+
+    def merge(self, o):
+        self.cocs += o.cocs; self.samples += o.samples
+        self.containers.update(o.containers); self.matrices.update(o.matrices)
+        for m, (ns, na) in o.methods.items():
+            t = self.methods.setdefault(m, [0, 0]); t[0] += ns; t[1] += na
+
+
+class KitTotals:
+    """Running kit-prep totals keyed by event. Feed it with add() or aggregate()."""
+
+    def __init__(self, event=None):
+        # event: None (one event), a COCRecord field name, or a callable(record) -> label
+        if isinstance(event, str) and event not in COCRecord.__dataclass_fields__:
+            raise ValueError("unknown COC field %r" % event)
+        self.event = (lambda r: getattr(r, event) or UNSPECIFIED) if isinstance(event, str) else event
+        self.events = {}; self.rejected = 0; self.reject_msgs = []
+
+    def add(self, data):
+        """Count one COC. Anything that fails for this record alone -- validation, the event
+        function, or an exception iter_source() yielded for an unreadable line -- is
+        counted in .rejected instead of raised."""
+        try:
+            if isinstance(data, Exception): raise data
+            rec = as_record(data); ev = str(self.event(rec)) if self.event else ALL_EVENTS
+        except Exception as e:
+            self.rejected += 1
+            if len(self.reject_msgs) < MAX_REJECTS: self.reject_msgs.append(str(e) if isinstance(e, ValueError) else repr(e))
+            return
+        t = self.events.get(ev) or self.events.setdefault(ev, EventTotals())
+        t.cocs += 1; t.samples += len(rec.samples)
+        kit = (rec.container_size or UNSPECIFIED, rec.preservative_type or UNSPECIFIED)
+        for s in rec.samples:
+            t.containers[kit] += _bottles(s.num_containers); t.matrices[s.matrix or UNSPECIFIED] += 1
+            for cat, al in expand_analyses(s.analyses):
+                if cat == "Packages": continue  # expanded into the categories that run them
+                m = t.methods.get(_method(cat, s.matrix))
+                if m is None: m = t.methods[_method(cat, s.matrix)] = [0, 0]
+                m[0] += 1; m[1] += len(al)
+
+    def totals(self, event=ALL_EVENTS):
+        """Totals for one event, or merged across every event."""
+        if event != ALL_EVENTS or list(self.events) == [ALL_EVENTS]: return self.events.get(event, EventTotals())
+        out = EventTotals()
+        for t in self.events.values(): out.merge(t)
+        return out
+
+    def event_names(self):
+        return sorted(e for e in self.events if e != ALL_EVENTS)
+
+    def rows(self):
+        """CSV rows (CSV_HEADER): per event, then all events. quantity is containers,
+        analyte determinations or samples for the containers, method and matrix sections."""
+        for ev in self.event_names() + [ALL_EVENTS]:
+            t = self.totals(ev)
+            yield (ev, "cocs", "COCs", "", t.samples, t.cocs)
+            for (size, pres), n in sorted(t.containers.items()): yield (ev, "containers", size, pres, "", n)
+            for m, (ns, na) in sorted(t.methods.items()): yield (ev, "method", m, "", ns, na)
+            for mx, n in sorted(t.matrices.items()): yield (ev, "matrix", mx, "", n, n)
+
+    def write_csv(self, f):
+        w = csv.writer(f); w.writerow(CSV_HEADER); w.writerows(self.rows())
+
+
+def aggregate(cocs, event=None):
+    """Consume an iterable of coc_data/COCRecords in one pass; returns KitTotals.
+    Records that fail (validation or otherwise) are counted in .rejected, not raised."""
+    kt = KitTotals(event)
+    for d in cocs: kt.add(d)
+    return kt
+
+
+def iter_source(path):
+    """Stream coc_data from a PDF directory, a .jsonl file or a .json order file.
+    An unreadable line or payload is yielded as a ValueError for KitTotals.add() to reject."""
+    if os.path.isdir(path):
+        from coc_payload import scan_directory
+        for fp, p in scan_directory(path):
+            yield p.get("data") or {} if isinstance(p, dict) else ValueError("%s: payload is not an object" % fp)
+    elif path.lower().endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for n, ln in enumerate(f, 1):
+                if not ln.strip(): continue
+                try: d = json.loads(ln)
+                except ValueError as e: yield ValueError("%s line %d: %s" % (path, n, e)); continue
+                yield d["data"] if isinstance(d, dict) and "format" in d and "data" in d else d
+    else:
+        with open(path, encoding="utf-8-sig") as f: doc = json.load(f)
+        yield from doc if isinstance(doc, list) else [doc]
+
+
+# === Summary PDF ===
+
+_RH = 11; _SEC_H = 9
+
+def _table(c, x, top, title, cols, rows, bottom):
+    """One titled table. cols: [(header, width, "left"|"right")]; rows of strings.
+    Rows that do not fit above bottom are summarized in a final row."""
+    w = sum(cw for _, cw, _ in cols); xs = [x]
+    for _, cw, _ in cols: xs.append(xs[-1] + cw)
+    SECTION_LABEL(c, x, top-_SEC_H, w, _SEC_H, title); top -= _SEC_H
+    fit = int((top - bottom) // _RH) - 1
+    if len(rows) > fit:
+        rest = len(rows) - fit + 1; rows = rows[:fit-1] + [("... %d more (see CSV)" % rest,) + ("",) * (len(cols)-1)]
+    n = len(rows) + 1; ys = [top - i*_RH for i in range(n+1)]
+    SHADE(c, [(x, top-_RH, w, _RH)], SECTION_BG)
+    SHADE(c, [(x, top-(i+1)*_RH, w, _RH) for i in range(2, n, 2)], ROW_SHADE)
+    GRID(c, xs, ys)
+    runs = []
+    for ri, row in enumerate([tuple(h for h, _, _ in cols)] + rows):
+        fn = "Helvetica-Bold" if ri == 0 else "Helvetica"; fs = 6.5; y = top - (ri+1)*_RH + 3.5
+        for (_, cw, align), x0, v in zip(cols, xs, row):
+            v = str(v)
+            while len(v) > 1 and stringWidth(v, fn, fs) > cw - 4: v = v[:-2] + "…"
+            runs.append((fn, fs, x0+cw-2-stringWidth(v, fn, fs) if align == "right" else x0+2, y, v))
+    TEXTS(c, runs)
+
+
+def _report_footer(c, pn, tp):
+    """Page numbers only: this is an internal tally, not the controlled COC form."""
+    y = BM+3
+    c.setStrokeColor(black); c.setLineWidth(0.3); c.line(LM, y, RM, y)
+    c.setFont("Helvetica", 4.5); c.setFillColor(black); c.drawRightString(RM, y-8, "Page %d of %d" % (pn, tp))
+
+
+def _page(c, title, label, sub, t, pn, tp):
+    hdr_top = TM; hdr_bot = TM - 34
+    c.setStrokeColor(KELP_BLUE); c.setLineWidth(1.5)
+    c.line(LM, hdr_top, RM, hdr_top); c.line(LM, hdr_bot, RM, hdr_bot)
+    R(c, LM, hdr_bot, RM-LM, hdr_top-hdr_bot, lw=LW_OUTER)
+    c.setFont("Helvetica-Bold", FS_TITLE); c.setFillColor(KELP_BLUE)
+    c.drawCentredString((LM+RM)/2, hdr_top-14, title)
+    c.setFont("Helvetica", 7.5); c.setFillColor(black)
+    c.drawCentredString((LM+RM)/2, hdr_top-25, sub)
+    top = hdr_bot - 8; bottom = BM + 12
+    summary = "%d COCs  |  %d samples  |  %d containers" % (t.cocs, t.samples, sum(t.containers.values()))
+    _table(c, LM, top, "TOTALS", [("Event", 200, "left"), ("COCs / Samples / Containers", 160, "right")],
+           [(label, summary)], bottom)
+    top -= _SEC_H + 3*_RH
+    gap = 12; w3 = (RM - LM - 2*gap)
+    _table(c, LM, top, "CONTAINERS BY SIZE / PRESERVATIVE",
+           [("Size", 0.14*w3, "left"), ("Preservative", 0.16*w3, "left"), ("Containers", 0.08*w3, "right")],
+           [(s, p, n) for (s, p), n in sorted(t.containers.items())], bottom)
+    x2 = LM + 0.38*w3 + gap
+    _table(c, x2, top, "ANALYSES BY METHOD",
+           [("Method", 0.22*w3, "left"), ("Samples", 0.08*w3, "right"), ("Analytes", 0.08*w3, "right")],
+           [(m, ns, na) for m, (ns, na) in sorted(t.methods.items())], bottom)
+    x3 = x2 + 0.38*w3 + gap
+    _table(c, x3, top, "SAMPLES BY MATRIX", [("Matrix", 0.14*w3, "left"), ("Samples", 0.10*w3, "right")],
+           sorted(t.matrices.items()), bottom)
+    _report_footer(c, pn, tp)
+
+
+def render_pdf(kt, title="KIT-PREP SUMMARY"):
+    """Summary page for all events, then one page per event (if more than one). Returns BytesIO."""
+    buf = io.BytesIO(); c = canvas.Canvas(buf, pagesize=(PW, PH)); c.setTitle("KELP Kit-Prep Summary")
+    events = kt.event_names(); pages = [ALL_EVENTS] + (events if len(events) > 1 else [])
+    stamp = datetime.datetime.now().strftime("%m/%d/%Y %H:%M")
+    for pn, ev in enumerate(pages, 1):
+        label = events[0] if ev == ALL_EVENTS and len(events) == 1 else ev
+        sub = "%s  |  generated %s" % (label, stamp)
+        if kt.rejected and ev == ALL_EVENTS: sub += "  |  %d COCs rejected (invalid)" % kt.rejected
+        _page(c, title, label, sub, kt.totals(ev), pn, len(pages)); c.showPage()
+    c.save(); buf.seek(0)
+    return buf
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Kit-prep totals across a batch of COCs.")
+    ap.add_argument("sources", nargs="+")
+    ap.add_argument("--event", default=None, help="COC field that names the sampling event (e.g. project_name)")
+    ap.add_argument("--csv", default=None, help="write CSV here ('-' for stdout)")
+    ap.add_argument("--pdf", default=None, help="write the summary PDF here")
+    a = ap.parse_args()
+    try: kt = aggregate((d for src in a.sources for d in iter_source(src)), a.event)
+    except (OSError, ValueError) as e: ap.error(str(e))
+    if a.csv == "-" or not (a.csv or a.pdf): kt.write_csv(sys.stdout)
+    elif a.csv:
+        with open(a.csv, "w", newline="", encoding="utf-8") as f: kt.write_csv(f)
+    if a.pdf:
+        with open(a.pdf, "wb") as f: f.write(render_pdf(kt).getvalue())
+    for m in kt.reject_msgs: print("rejected: " + m, file=sys.stderr)
@@ -0,0 +1,199 @@
+"""
+coc_ledger.py - KELP custody ledger v1
+
+- Append-only Merkle log (RFC 6962 hashing) in a local SQLite file
+- Records each generated COC's PDF hash and every custody transfer
+- O(log n) inclusion proofs: verify one COC without replaying the log
+- Appends are buffered and committed in batches (one transaction each)
+
+Usage: python coc_ledger.py LEDGER root
+       python coc_ledger.py LEDGER prove COC_ID
+       python coc_ledger.py LEDGER verify COC_ID PDF
+       python coc_ledger.py LEDGER transfer COC_ID RELINQUISHED_BY RECEIVED_BY [--note TEXT]
+"""
+import argparse, datetime, hashlib, json, sqlite3, threading
+
+EVENT_GENERATED = "generated"; EVENT_TRANSFER = "transfer"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (idx INTEGER PRIMARY KEY, coc_id TEXT NOT NULL, body BLOB NOT NULL);
+CREATE INDEX IF NOT EXISTS entries_coc ON entries (coc_id);
+CREATE TABLE IF NOT EXISTS nodes (level INTEGER, idx INTEGER, hash BLOB NOT NULL, PRIMARY KEY (level, idx)) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS entries_ro_u BEFORE UPDATE ON entries BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS entries_ro_d BEFORE DELETE ON entries BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS nodes_ro_u BEFORE UPDATE ON nodes BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS nodes_ro_d BEFORE DELETE ON nodes BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+"""
+
+
+def leaf_hash(body):
+    return hashlib.sha256(b"\x00" + body).digest()
+
+def node_hash(left, right):
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+def _canon(entry):
+    return json.dumps(entry, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def _split(n):
+    """Largest power of two strictly less than n (n > 1)."""
+    k = 1
+    while k << 1 < n: k <<= 1
+    return k
+
+
+def verify_inclusion(entry, index, tree_size, path, root):
+    """Check an audit path (hex or bytes) for entry at index in a tree of tree_size with root.
+    Needs only the entry, its proof and a trusted root -- no access to the ledger."""
+    unhex = lambda h: bytes.fromhex(h) if isinstance(h, str) else h
+    if not 0 <= index < tree_size: return False
+    fn, sn, r = index, tree_size - 1, leaf_hash(_canon(entry))
+    for p in map(unhex, path):
+        if sn == 0: return False
+        if fn & 1 or fn == sn:
+            r = node_hash(p, r)
+            while not fn & 1 and fn: fn >>= 1; sn >>= 1
+        else: r = node_hash(r, p)
+        fn >>= 1; sn >>= 1
+    return sn == 0 and r == unhex(root)
+
+
+class CustodyLedger:
+    """Local tamper-evident custody log.
+
+    Only complete (power-of-two aligned) subtree hashes are stored, so appending
+    writes at most log2(n)+1 nodes and any root or audit path needs O(log n) reads.
+    """
+
+    def __init__(self, path="kelp_custody.db", batch_size=256):
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL"); self.db.executescript(_SCHEMA)
+        self.batch_size = batch_size; self._pending = []; self._lock = threading.RLock()
+        self.size = self.db.execute("SELECT COALESCE(MAX(idx)+1, 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.flush(); self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- appends ---
+
+    def append(self, entry):
+        """Queue an entry dict (must carry coc_id); committed on flush() or every batch_size entries."""
+        if not entry.get("coc_id"): raise ValueError("ledger entries need a coc_id")
+        entry = dict(entry); entry.setdefault("ts", datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"))
+        with self._lock:
+            self._pending.append(entry)
+            if len(self._pending) >= self.batch_size: self.flush()
+
+    def record_generated(self, coc_id, pdf_bytes):
+        """Log a rendered COC. The hash covers the PDF as issued; later incremental
+        updates (coc_stamp) append bytes, so verify_pdf() checks the issued prefix."""
+        self.record_digest(coc_id, hashlib.sha256(pdf_bytes).hexdigest(), len(pdf_bytes))
+
+    def record_digest(self, coc_id, sha256, length):
+        """record_generated() for a digest computed elsewhere (e.g. in a render worker)."""
+        self.append({"type": EVENT_GENERATED, "coc_id": coc_id, "sha256": sha256, "length": length})
+
+    def record_transfer(self, coc_id, relinquished_by, received_by, when=None, note=""):
+        """Log one relinquished-by/received-by custody transfer."""
+        e = {"type": EVENT_TRANSFER, "coc_id": coc_id, "relinquished_by": relinquished_by, "received_by": received_by}
+        if when: e["ts"] = when.isoformat(timespec="seconds") if isinstance(when, datetime.datetime) else str(when)
+        if note: e["note"] = note
+        self.append(e)
+
+    def flush(self):
+        """Commit queued entries and their Merkle nodes in one transaction. Returns the new size."""
+        with self._lock:
+            if not self._pending: return self.size
+            return self._commit()
+
+    def _commit(self):
+        cur = self.db.cursor(); cur.execute("BEGIN IMMEDIATE")
+        try:
+            # re-read the size under the write lock: another process may share the ledger file
+            n = cur.execute("SELECT COALESCE(MAX(idx)+1, 0) FROM entries").fetchone()[0]
+            last = {}  # level -> (idx, hash) of the newest node this batch: the left sibling a new node completes
+            entries = []; nodes = []
+            for e in self._pending:
+                body = _canon(e); h = leaf_hash(body); level, i = 0, n
+                entries.append((n, e["coc_id"], body)); nodes.append((0, n, h))
+                while i & 1:
+                    prev = last.get(level)
+                    left = prev[1] if prev and prev[0] == i - 1 else self._node(level, i - 1)
+                    h = node_hash(left, h); level += 1; i >>= 1; nodes.append((level, i, h))
+                last[level] = (i, h); n += 1
+            cur.executemany("INSERT INTO entries VALUES (?,?,?)", entries)
+            cur.executemany("INSERT INTO nodes VALUES (?,?,?)", nodes)
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK"); raise
+        self.size = n; self._pending = []
+        return n
+
+    # --- tree ---
+
+    def _node(self, level, idx):
+        return self.db.execute("SELECT hash FROM nodes WHERE level=? AND idx=?", (level, idx)).fetchone()[0]
+
+    def _mth(self, lo, hi):
+        n = hi - lo
+        if n & (n - 1) == 0 and lo % n == 0: return self._node(n.bit_length() - 1, lo // n)
+        k = _split(n)
+        return node_hash(self._mth(lo, lo + k), self._mth(lo + k, hi))
+
+    def root(self, tree_size=None):
+        """(tree_size, root hex) of the committed log, or of an earlier prefix of it."""
+        n = self.size if tree_size is None else tree_size
+        return n, (self._mth(0, n) if n else hashlib.sha256(b"").digest()).hex()
+
+    def _path(self, m, lo, hi):
+        if hi - lo == 1: return []
+        k = _split(hi - lo)
+        if m < lo + k: return self._path(m, lo, lo + k) + [self._mth(lo + k, hi)]
+        return self._path(m, lo + k, hi) + [self._mth(lo, lo + k)]
+
+    def entries(self, coc_id):
+        """[(index, entry)] for a COC, oldest first."""
+        rows = self.db.execute("SELECT idx, body FROM entries WHERE coc_id=? ORDER BY idx", (coc_id,))
+        return [(i, json.loads(b)) for i, b in rows]
+
+    def prove(self, coc_id, tree_size=None):
+        """Inclusion proofs for every entry of coc_id against the current (or given) root."""
+        n, root = self.root(tree_size)
+        return [{"index": i, "entry": e, "tree_size": n, "root": root, "path": [p.hex() for p in self._path(i, 0, n)]}
+                for i, e in self.entries(coc_id) if i < n]
+
+    def verify_pdf(self, coc_id, pdf_bytes):
+        """True if pdf_bytes (possibly with stamps appended) starts with an issued COC logged
+        under coc_id and that log entry is provably included under the current root."""
+        for p in self.prove(coc_id):
+            e = p["entry"]
+            if e["type"] != EVENT_GENERATED or len(pdf_bytes) < e["length"]: continue
+            if hashlib.sha256(pdf_bytes[:e["length"]]).hexdigest() == e["sha256"] and \
+                    verify_inclusion(e, p["index"], p["tree_size"], p["path"], p["root"]):
+                return True
+        return False
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="KELP custody ledger.")
+    ap.add_argument("ledger"); sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("root")
+    sub.add_parser("prove").add_argument("coc_id")
+    v = sub.add_parser("verify"); v.add_argument("coc_id"); v.add_argument("pdf")
+    t = sub.add_parser("transfer"); t.add_argument("coc_id"); t.add_argument("relinquished_by"); t.add_argument("received_by")
+    t.add_argument("--note", default="")
+    a = ap.parse_args()
+    with CustodyLedger(a.ledger) as led:
+        if a.cmd == "root": n, r = led.root(); print(json.dumps({"tree_size": n, "root": r}))
+        elif a.cmd == "prove":
+            for p in led.prove(a.coc_id): print(json.dumps(p, separators=(",", ":")))
+        elif a.cmd == "verify":
+            with open(a.pdf, "rb") as f: ok = led.verify_pdf(a.coc_id, f.read())
+            print("OK" if ok else "NOT VERIFIED"); raise SystemExit(0 if ok else 1)
+        else: led.record_transfer(a.coc_id, a.relinquished_by, a.received_by, note=a.note)
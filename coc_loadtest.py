@@ -0,0 +1,273 @@
+"""
+coc_loadtest.py - KELP local load-test harness v1
+
+- "app": N concurrent headless browser sessions on one local `streamlit run coc2026.py`
+  server fill the form and click Generate
+- "render": generate_coc_pdf driven directly at the same concurrency
+- Reports p50/p95/p99 latency, CPU saturation and memory per session
+
+App sessions speak the frontend's websocket protocol to a fresh server, so they contend
+for its one process as real users do; CPU and memory are the server's (read from /proc).
+Render sessions are threads in this process. App mode needs the websockets package,
+which current Streamlit installs for its server.
+
+Usage: python coc_loadtest.py [app|render|both] [--sessions N] [--iterations K] [--samples S]
+"""
+import argparse, contextlib, os, queue, random, shutil, socket, statistics, subprocess, sys, tempfile, threading, time, tracemalloc
+import urllib.request
+
+from coc_catalog import KELP_ANALYTE_CATALOG
+from coc_pdf_engine import generate_coc_pdf, MAX_SAMPLE_ROWS
+from coc_records import COCRecord, SampleRecord
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coc2026.py")
+_CATS = [c for c in KELP_ANALYTE_CATALOG if c != "Packages"]
+_WIDGETS = ("button", "multiselect", "number_input", "selectbox", "text_input")  # the kinds AppSession drives
+
+
+def _rss():
+    """Resident set size in bytes (Linux /proc; falls back to peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r if sys.platform == "darwin" else r * 1024
+
+
+def _proc_stats(pid):
+    """(CPU seconds, RSS bytes) of another process from /proc; (0.0, 0) where /proc is missing."""
+    try:
+        with open("/proc/%d/stat" % pid) as f: st = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/%d/statm" % pid) as f: rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return (int(st[11]) + int(st[12])) / os.sysconf("SC_CLK_TCK"), rss
+    except (OSError, ValueError, IndexError): return 0.0, 0
+
+
+def _pcts(xs):
+    """p50/p95/p99/max of xs in milliseconds."""
+    if not xs: return {"n": 0}
+    if len(xs) == 1: q = [xs[0]] * 99
+    else: q = statistics.quantiles(xs, n=100, method="inclusive")
+    return {"n": len(xs), "p50": 1000*q[49], "p95": 1000*q[94], "p99": 1000*q[98], "max": 1000*max(xs)}
+
+
+def _pick(rng, n_samples):
+    """Random per-sample selections: [(sample_id, matrix, {category: [analytes]})]."""
+    out = []
+    for i in range(n_samples):
+        cats = rng.sample(_CATS, rng.randint(1, 3))
+        out.append(("LT-%d" % (i+1), rng.choice(["DW", "GW", "WW"]),
+                    {c: rng.sample(KELP_ANALYTE_CATALOG[c]["analytes"], min(4, len(KELP_ANALYTE_CATALOG[c]["analytes"]))) for c in cats}))
+    return out
+
+
+def _record(rng, n_samples):
+    return COCRecord(company_name="Load Test Co", contact_name="Bench", time_zone="PT",
+                     samples=tuple(SampleRecord(sample_id=sid, matrix=m, comp_grab="GRAB", end_date="10/01/2026",
+                                                end_time="09:30", num_containers="2",
+                                                analyses=tuple((c, tuple(al)) for c, al in sel.items()))
+                                   for sid, m, sel in _pick(rng, n_samples)))
+
+
+class AppServer:
+    """`streamlit run coc2026.py` on a free local port, headless, with the ledger, profiles
+    and client index pointed at scratch files so test COCs stay out of the real ones."""
+
+    def __init__(self, timeout=60):
+        self.tmp = tempfile.mkdtemp(prefix="kelp_loadtest_")
+        with socket.socket() as so: so.bind(("127.0.0.1", 0)); self.port = so.getsockname()[1]
+        env = dict(os.environ, KELP_LEDGER=os.path.join(self.tmp, "custody.db"),
+                   KELP_PROFILES=os.path.join(self.tmp, "profiles.json"), KELP_CLIENTS=os.path.join(self.tmp, "clients.db"))
+        self.log = open(os.path.join(self.tmp, "server.log"), "wb")
+        self.proc = subprocess.Popen([sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless=true",
+                                      "--server.address=127.0.0.1", "--server.port=%d" % self.port,
+                                      "--server.fileWatcherType=none", "--browser.gatherUsageStats=false"],
+                                     cwd=self.tmp, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:%d/_stcore/health" % self.port, timeout=1) as r:
+                    if r.status == 200: break
+            except OSError: pass
+            if self.proc.poll() is not None or time.monotonic() > deadline:
+                self.close(); raise RuntimeError("streamlit server did not start")
+            time.sleep(0.2)
+
+    def stats(self):
+        """(CPU seconds, RSS bytes) of the server process."""
+        return _proc_stats(self.proc.pid)
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try: self.proc.wait(10)
+            except subprocess.TimeoutExpired: self.proc.kill(); self.proc.wait()
+        self.log.close(); shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AppSession:
+    """One headless browser tab: the frontend's websocket protocol (BackMsg/ForwardMsg
+    protobufs on /_stcore/stream), with widgets addressed by key, or by label if keyless."""
+
+    def __init__(self, port, timeout=120):
+        from websockets.sync.client import connect
+        self._stack = contextlib.ExitStack()  # websockets wants its connection used as a context manager
+        self.conn = self._stack.enter_context(connect("ws://127.0.0.1:%d/_stcore/stream" % port, subprotocols=["streamlit"],
+                                                      max_size=None, open_timeout=timeout))
+        self.timeout = timeout; self.widgets = {}; self.states = {}; self.alerts = []
+
+    def close(self):
+        self._stack.close()
+
+    def set(self, name, value):
+        """Stage a widget value for the next run, encoded as the frontend encodes it."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        kind, p = self.widgets[name]; w = WidgetState(id=p.id)
+        if kind == "multiselect": w.string_array_value.data[:] = value
+        elif kind == "number_input":
+            if p.data_type == p.INT: w.int_value = value
+            else: w.double_value = value
+        else: w.string_value = value
+        self.states[p.id] = w
+        return self
+
+    def run(self, click=None):
+        """Rerun the script with every staged value (and a button press); returns the
+        seconds until the server reports the run finished."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.runtime.state.common import user_key_from_element_id
+        msg = BackMsg(); msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        if click: msg.rerun_script.widget_states.widgets.add(id=self.widgets[click][1].id, trigger_value=True)
+        t = time.perf_counter(); self.conn.send(msg.SerializeToString())
+        self.widgets = {}; self.alerts = []
+        while True:
+            m = ForwardMsg(); m.ParseFromString(self.conn.recv(self.timeout))
+            kind = m.WhichOneof("type")
+            if kind == "delta" and m.delta.WhichOneof("type") == "new_element":
+                el = m.delta.new_element; ty = el.WhichOneof("type")
+                if ty in _WIDGETS: p = getattr(el, ty); self.widgets[user_key_from_element_id(p.id) or p.label] = (ty, p)
+                elif ty in ("alert", "exception"): self.alerts.append(el)
+            elif kind == "script_finished" and m.script_finished != m.FINISHED_EARLY_FOR_RERUN:
+                return time.perf_counter() - t
+
+    def succeeded(self):
+        """True if the last run showed st.success and raised nothing."""
+        from streamlit.proto.Alert_pb2 import Alert
+        return not any(e.HasField("exception") for e in self.alerts) and \
+            any(e.HasField("alert") and e.alert.format == Alert.SUCCESS for e in self.alerts)
+
+
+def _app_session(idx, port, iterations, n_samples, barrier, results):
+    """One browser session on the shared server, run from a thread of this process."""
+    try:
+        rng = random.Random(idx); reruns = []; gens = []; errors = 0
+        s = AppSession(port)
+        try:
+            s.run(); s.run(click="generate")  # first page load + one generate: the session's steady-state footprint
+            barrier.wait()
+            for _ in range(iterations):
+                reruns.append(s.set("Number of Samples", n_samples).run())
+                s.set("ci_company_name", "Load Test Co %d" % idx)
+                for i, (sid, matrix, sel) in enumerate(_pick(rng, n_samples)):
+                    s.set("sid_%d" % i, sid).set("mat_%d" % i, matrix)
+                    for c, al in sel.items(): s.set("a_%s_%d" % (c, i), al)
+                    reruns.append(s.run())
+                gens.append(s.run(click="generate"))
+                if not s.succeeded(): errors += 1
+        finally: s.close()
+        results.put({"rerun": reruns, "generate": gens, "errors": errors})
+    except threading.BrokenBarrierError: results.put({"failure": "aborted"})
+    except Exception as e:
+        barrier.abort(); results.put({"failure": "session %d: %r" % (idx, e)})
+
+
+def _render_session(idx, iterations, n_samples, barrier, results):
+    """One render-path session as a thread, sharing the GIL like sessions on one server."""
+    try:
+        rng = random.Random(idx); recs = [_record(rng, n_samples) for _ in range(iterations)]; gens = []
+        barrier.wait()
+        for r in recs:
+            t = time.perf_counter(); buf, _ = generate_coc_pdf(r); buf.getvalue(); gens.append(time.perf_counter() - t)
+        results.put({"generate": gens, "errors": 0})
+    except threading.BrokenBarrierError: results.put({"failure": "aborted"})
+    except Exception as e:
+        barrier.abort(); results.put({"failure": "session %d: %r" % (idx, e)})
+
+
+def run(mode, sessions, iterations, n_samples):
+    """Run one scenario; returns a result dict (latencies in ms, memory in MB).
+
+    app: client threads on one fresh server; CPU and memory of the server process.
+    render: one thread per session in this process, CPU and memory of this process.
+    """
+    go = threading.Barrier(sessions + 1); q = queue.Queue()
+    server = AppServer() if mode == "app" else None
+    try:
+        if server:
+            warm = AppSession(server.port); warm.run(); warm.run(click="generate"); warm.close()  # imports, caches
+            workers = [threading.Thread(target=_app_session, args=(i, server.port, iterations, n_samples, go, q), daemon=True)
+                       for i in range(sessions)]
+            stats = server.stats
+        else:
+            workers = [threading.Thread(target=_render_session, args=(i, iterations, n_samples, go, q), daemon=True)
+                       for i in range(sessions)]
+            stats = lambda: (time.process_time(), _rss())
+        rss0 = stats()[1]
+        for w in workers: w.start()
+        try: go.wait()  # every session is loaded; start the clock together
+        except threading.BrokenBarrierError: pass
+        cpu0, rss1 = stats(); t0 = time.perf_counter()
+        res = [q.get() for _ in workers]
+        wall = time.perf_counter() - t0; cpu, rss = stats(); cpu -= cpu0
+        for w in workers: w.join()
+    finally:
+        if server: server.close()
+    failed = [r["failure"] for r in res if "failure" in r]
+    if failed: raise RuntimeError("; ".join(f for f in failed if f != "aborted") or failed[0])
+    # app: server growth from the sessions' first load + generate; render: includes buffers still held by the allocator
+    mem = max(0, (rss1 if server else rss) - rss0)/sessions
+    gens = [x for r in res for x in r["generate"]]; reruns = [x for r in res for x in r.get("rerun", ())]
+    return {"mode": mode, "sessions": sessions, "iterations": iterations, "samples": n_samples,
+            "generate": _pcts(gens), "rerun": _pcts(reruns), "errors": sum(r["errors"] for r in res),
+            "throughput_per_s": len(gens)/wall if wall else 0.0, "wall_s": wall,
+            "cpu_cores_busy": cpu/wall if wall else 0.0,
+            "cpu_saturation": cpu/(wall*(os.cpu_count() or 1)) if wall else 0.0,
+            "mem_per_session_mb": mem/2**20, "rss_mb": rss/2**20}
+
+
+def render_peak_mb(n_samples):
+    """Python-heap peak of a single render (tracemalloc), for the per-request share of memory."""
+    r = _record(random.Random(0), n_samples); generate_coc_pdf(r)  # warm font/catalog caches
+    tracemalloc.start(); generate_coc_pdf(r); peak = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+    return peak/2**20
+
+
+def _print(res):
+    print("[%s] %d sessions x %d iterations, %d samples/COC, %d errors" % (res["mode"], res["sessions"], res["iterations"], res["samples"], res["errors"]))
+    for k in ("generate", "rerun"):
+        p = res[k]
+        if p["n"]: print("  %-9s n=%-5d p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms  max %7.1f ms" % (k, p["n"], p["p50"], p["p95"], p["p99"], p["max"]))
+    print("  throughput %.1f PDF/s over %.1f s; CPU %.2f cores busy (%.0f%% of %d)" % (
+        res["throughput_per_s"], res["wall_s"], res["cpu_cores_busy"], 100*res["cpu_saturation"], os.cpu_count() or 1))
+    print("  memory %.1f MB/session, %s RSS %.1f MB" % (res["mem_per_session_mb"], "server" if res["mode"] == "app" else "process", res["rss_mb"]))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local load test for coc2026.py and generate_coc_pdf.")
+    ap.add_argument("mode", nargs="?", choices=["app", "render", "both"], default="both")
+    ap.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 8], help="concurrency levels to sweep")
+    ap.add_argument("--iterations", type=int, default=5, help="COCs generated per session")
+    ap.add_argument("--samples", type=int, default=3, help="samples per COC (max %d)" % MAX_SAMPLE_ROWS)
+    a = ap.parse_args()
+    n = max(1, min(a.samples, MAX_SAMPLE_ROWS))
+    print("single render heap peak: %.2f MB" % render_peak_mb(n))
+    for mode in (["render", "app"] if a.mode == "both" else [a.mode]):
+        for s in a.sessions: _print(run(mode, s, a.iterations, n))
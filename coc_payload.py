@@ -0,0 +1,85 @@
+"""
+coc_payload.py - Machine-readable COC payload v1
+
+- Normalized coc_data + catalog version + COC ID embedded as a PDF file attachment
+- Extractor reads received PDFs via mmap and only locates the payload stream
+- Directory scan for bulk LIMS intake (python coc_payload.py <dir> > intake.jsonl)
+"""
+import json, mmap, os, re, sys, zlib
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFDictionary, PDFName, PDFStream, PDFString, PDFZCompress
+
+from coc_catalog import CATALOG_VERSION
+from coc_records import as_record
+
+PAYLOAD_FORMAT = "kelp-coc/1"
+PAYLOAD_FILENAME = "kelp_coc.json"
+PAYLOAD_MARKER = b"/KELPCOCPayload"
+
+_LENGTH_RE = re.compile(rb"/Length\s+(\d+)")
+
+
+def normalize_coc_data(data):
+    """Normalized coc_data for embedding (see COCRecord.to_dict)."""
+    return as_record(data).to_dict()
+
+
+def build_payload(data, coc_id):
+    """Compact JSON bytes for the embedded payload."""
+    doc = {"format": PAYLOAD_FORMAT, "coc_id": coc_id, "catalog_version": CATALOG_VERSION,
+           "data": normalize_coc_data(data)}
+    return json.dumps(doc, separators=(",", ":"), sort_keys=True, default=str).encode("utf-8")
+
+
+def embed_payload(c, data, coc_id):
+    """Attach the payload to canvas c as an embedded file (Names/EmbeddedFiles)."""
+    body = build_payload(data, coc_id)
+    ef = PDFStream(PDFDictionary({"Type": PDFName("EmbeddedFile"), "Subtype": "/application#2Fjson",
+                                  "KELPCOCPayload": PDFString(coc_id),
+                                  "Params": PDFDictionary({"Size": len(body)})}),
+                   content=body, filters=[PDFZCompress])
+    spec = PDFDictionary({"Type": PDFName("Filespec"), "F": PDFString(PAYLOAD_FILENAME),
+                          "UF": PDFString(PAYLOAD_FILENAME), "Desc": PDFString("KELP COC data " + coc_id),
+                          "AFRelationship": PDFName("Data"), "EF": PDFDictionary({"F": c._doc.Reference(ef)})})
+    names = PDFDictionary({"Names": PDFArray([PDFString(PAYLOAD_FILENAME), c._doc.Reference(spec)])})
+    c._doc.Catalog.Names = PDFDictionary({"EmbeddedFiles": names})
+
+
+def _read_payload(buf):
+    at = buf.rfind(PAYLOAD_MARKER)
+    if at < 0: return None
+    obj = buf.rfind(b" obj", 0, at)
+    sp = buf.find(b"stream", at)
+    if obj < 0 or sp < 0: return None
+    m = _LENGTH_RE.search(buf[obj:sp])
+    if not m: return None
+    start = sp + 6
+    if buf[start:start+2] == b"\r\n": start += 2
+    elif buf[start:start+1] in (b"\n", b"\r"): start += 1
+    raw = buf[start:start+int(m.group(1))]
+    if b"/FlateDecode" in buf[obj:sp]: raw = zlib.decompress(raw)
+    return json.loads(raw)
+
+
+def extract_payload(src):
+    """Return the embedded payload dict from a PDF path or bytes, or None if absent."""
+    if isinstance(src, (bytes, bytearray, memoryview)): return _read_payload(bytes(src))
+    with open(src, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _read_payload(mm)
+
+
+def scan_directory(path, suffix=".pdf"):
+    """Yield (file_path, payload) for every PDF under path that carries a payload."""
+    for root, _, files in os.walk(path):
+        for fn in sorted(files):
+            if not fn.lower().endswith(suffix): continue
+            fp = os.path.join(root, fn)
+            try: payload = extract_payload(fp)
+            except (OSError, ValueError, zlib.error): continue
+            if payload: yield fp, payload
+
+
+if __name__ == "__main__":
+    for fp, payload in scan_directory(sys.argv[1] if len(sys.argv) > 1 else "."):
+        sys.stdout.write(json.dumps({"file": fp, **payload}, separators=(",", ":")) + "\n")
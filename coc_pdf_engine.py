@@ -4,8 +4,10 @@ coc_pdf_engine.py - KELP COC PDF Generator v20
 - 0.15" margins (11pt) for maximum printable area
 - Hybrid chemical symbols in analysis column headers
 - 2-line vertical text per column (method + label)
+- Normalized coc_data embedded as a JSON attachment (see coc_payload.py)
 """
 import io, os
+from dataclasses import replace
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.lib.colors import black, white, HexColor
@@ -28,9 +30,16 @@ TM = 601; BM = 11
 FS_TITLE = 12; FS_LABEL = 7; FS_VALUE = 8.5; FS_HEADER = 7
 FS_LEGEND = 6; FS_FOOTER = 5; FS_VERT = 5.5
 
-COL2 = 230; ACOL = 470
+COL2 = 230; ACOL = 470; MAX_SAMPLE_ROWS = 10
+KELP_STRIP_W = 10; COMMENT_W = 88; PNC_W = 20
+
+# Right-side KELP-use fields, top to bottom: (coc_data key, label)
+SIDE_FIELDS = [("project_manager","Project Mgr.:"),("acct_num","AcctNum / Client ID:"),("table_number","Table #:"),("profile_template","Profile / Template:"),("prelog_id","Prelog / Bottle Ord. ID:")]
 
 from coc_catalog import KELP_ANALYTE_CATALOG, CAT_SHORT_MAP, SYMBOL_MAP, to_symbol, generate_coc_id, get_methods_for_category, POTABLE_MATRICES, NONPOTABLE_MATRICES
+from coc_records import SampleRecord, COCValidationError, as_record
+from coc_payload import embed_payload
+from coc_profiles import expand_analyses
 
 # === Drawing primitives ===
 
@@ -38,11 +47,15 @@ def R(c,x,y,w,h,fill=None,lw=LW_INNER):
     if fill: c.setFillColor(fill); c.rect(x,y,w,h,fill=1,stroke=0)
     c.setStrokeColor(black); c.setLineWidth(lw); c.rect(x,y,w,h,fill=0,stroke=1)
 
-def T(c,x,y,txt,fs=FS_LABEL,bold=False,font="Helvetica",maxw=None,color=black):
-    if not txt: return
-    fn="Helvetica-Bold" if bold else font; s=float(fs); t=str(txt)
+def FIT(t,fn,fs,maxw=None):
+    s=float(fs)
     if maxw:
         while s>4.0 and stringWidth(t,fn,s)>maxw: s-=0.3
+    return s
+
+def T(c,x,y,txt,fs=FS_LABEL,bold=False,font="Helvetica",maxw=None,color=black):
+    if not txt: return
+    fn="Helvetica-Bold" if bold else font; t=str(txt); s=FIT(t,fn,fs,maxw)
     c.setFont(fn,s); c.setFillColor(color); c.drawString(x,y,t)
 
 def TV(c,x,y,txt,fs=FS_VALUE,maxw=None):
@@ -65,6 +78,30 @@ def VTEXT(c,x,y,txt,fs=FS_VERT,bold=False):
 def HLINE(c,x1,x2,y,lw=0.4):
     c.setStrokeColor(black); c.setLineWidth(lw); c.line(x1,y,x2,y)
 
+def GRID(c,xs,ys,lw=LW_INNER):
+    """Stroke every rule of an xs-by-ys grid as a single path."""
+    x0,x1=min(xs),max(xs); y0,y1=min(ys),max(ys); p=c.beginPath()
+    for y in ys: p.moveTo(x0,y); p.lineTo(x1,y)
+    for x in xs: p.moveTo(x,y0); p.lineTo(x,y1)
+    c.saveState(); c.setLineCap(2); c.setStrokeColor(black); c.setLineWidth(lw)
+    c.drawPath(p,stroke=1,fill=0); c.restoreState()
+
+def SHADE(c,rects,fill):
+    """Fill a list of (x,y,w,h) rects as a single path."""
+    if not rects: return
+    p=c.beginPath()
+    for x,y,w,h in rects: p.rect(x,y,w,h)
+    c.setFillColor(fill); c.drawPath(p,stroke=0,fill=1)
+
+def TEXTS(c,items,color=black):
+    """Emit (font,size,x,y,text) runs in one text object, grouped by font."""
+    if not items: return
+    to=c.beginText(); to.setFillColor(color); cur=None
+    for fn,fs,x,y,t in sorted(items,key=lambda i:(i[0],i[1])):
+        if (fn,fs)!=cur: to.setFont(fn,fs); cur=(fn,fs)
+        to.setTextOrigin(x,y); to.textOut(t)
+    c.drawText(to)
+
 def SECTION_LABEL(c,x,y,w,h,text):
     c.setFillColor(SECTION_BG); c.rect(x,y,w,h,fill=1,stroke=0)
     c.setStrokeColor(black); c.setLineWidth(LW_SECTION); c.rect(x,y,w,h,fill=0,stroke=1)
@@ -80,30 +117,45 @@ def _footer(c,pn,tp,coc_id=""):
     c.drawString(LM,y-8,lt); c.drawRightString(RM,y-8,"CONTROLLED DOCUMENT  |  Page "+str(pn)+" of "+str(tp))
 
 
+def _kelp_field_slots():
+    """Value positions of the lab-side fields on page 1: {key: (x, y, fs, maxw)}.
+    Page-1 geometry is fixed, so coc_stamp can overlay these onto an issued PDF."""
+    rh = 11; sec_h = 9; z3_rh = 20; lrh = 14; sbf_h = 19
+    z4_top = TM - 34 - 2*sec_h - 5*rh - sec_h - 4*z3_rh
+    tall_bot = z4_top - 5*lrh - 11 - 34
+    sbx = RM - PNC_W - COMMENT_W
+    slots = {"kelp_ordering_id": (570+77, TM-21, FS_VALUE, RM-(570+77)-4)}
+    fy = z4_top
+    for key, lbl in SIDE_FIELDS:
+        lw2 = stringWidth(lbl,"Helvetica",FS_LABEL)+3
+        slots[key] = (sbx+lw2, fy-sbf_h+9, 7, COMMENT_W-lw2-2); fy -= sbf_h
+    lr_top = tall_bot - sec_h - MAX_SAMPLE_ROWS*18 - sec_h - 14
+    for key, dx, w in [("num_coolers",48,26),("thermometer_id",140,56),("temperature",240,76)]:  # w: up to the next label
+        slots[key] = (LM+dx, lr_top-9, 7.5, w)
+    rsx = LM + 2*(215+92); slots["tracking_number"] = (rsx+46, lr_top-10-9+3, 7, RM-rsx-50)
+    return slots
+
+KELP_FIELD_SLOTS = _kelp_field_slots()
+
+def KV(c,key,val):
+    x,y,fs,maxw = KELP_FIELD_SLOTS[key]; TV(c,x,y,val,fs=fs,maxw=maxw)
+
+
 def _build_analysis_columns(samples, avail_h):
     """Build columns using hybrid symbols. Each label must fit as single vertical line.
-    Method strings are matrix-aware based on sample matrices present."""
-    short_to_full = {v: k for k, v in CAT_SHORT_MAP.items()}
+    Method strings are matrix-aware based on sample matrices present.
+    samples are SampleRecords, so categories are already full catalog names."""
     cat_analytes = {}
     cat_order = list(KELP_ANALYTE_CATALOG.keys())
     
     # Collect all matrices present on the COC
-    all_matrices = set()
-    for s in samples:
-        m = (s.get("matrix") or "").upper().strip()
-        if m: all_matrices.add(m)
+    all_matrices = {s.matrix for s in samples if s.matrix}
     
     for s in samples:
-        analyses = s.get("analyses", {})
-        if isinstance(analyses, list): analyses = {cat: [] for cat in analyses}
-        for cn, al in analyses.items():
-            if not al: continue
-            resolved = cn
-            if cn not in KELP_ANALYTE_CATALOG and cn in short_to_full:
-                resolved = short_to_full[cn]
-            if resolved not in cat_analytes: cat_analytes[resolved] = []
-            for a in al:
-                if a not in cat_analytes[resolved]: cat_analytes[resolved].append(a)
+        for cn, al in s.analyses:
+            seen = cat_analytes.setdefault(cn, {})
+            for a in al: seen[a] = None
+    cat_analytes = {cn: list(al) for cn, al in cat_analytes.items()}
 
     columns = []
     fn_bold = "Helvetica-Bold"
@@ -143,10 +195,18 @@ def _build_analysis_columns(samples, avail_h):
 
 
 def generate_coc_pdf(data, logo_path=None):
+    """Render a COC from a COCRecord or loose coc_data dict; returns (BytesIO, coc_id).
+    Dicts are validated up front (COCValidationError) before any drawing."""
+    d = as_record(data)
+    if len(d.samples) > MAX_SAMPLE_ROWS:
+        raise COCValidationError(["%d samples; the COC holds %d" % (len(d.samples), MAX_SAMPLE_ROWS)])
+    submitted = d  # embedded as ordered: a package and the analytes it covers are not separate orders
+    # packages -> their analytes for drawing, once per COC (memoized per distinct selection)
+    d = replace(d, samples=tuple(replace(s, analyses=expand_analyses(s.analyses)) for s in d.samples))
     buf = io.BytesIO(); c = canvas.Canvas(buf, pagesize=(PW, PH))
     c.setTitle("KELP Chain-of-Custody")
-    d = data; g = lambda k, dflt="": d.get(k, dflt) or dflt
-    coc_id = d.get("coc_id") or generate_coc_id()
+    g = lambda k, dflt="": getattr(d, k) or dflt
+    coc_id = d.coc_id or generate_coc_id()
     total_pages = 2
 
     # Geometry calculations
@@ -164,10 +224,9 @@ def generate_coc_pdf(data, logo_path=None):
     tall_bot = th_top - th_h
     tall_h = z4_top - tall_bot
 
-    dyn_cols = _build_analysis_columns(d.get("samples", []), tall_h)
+    dyn_cols = _build_analysis_columns(d.samples, tall_h)
     num_acols = max(len(dyn_cols), 1)
 
-    KELP_STRIP_W=10; COMMENT_W=88; PNC_W=20
     right_fixed = KELP_STRIP_W + COMMENT_W + PNC_W
     atotal_w = RM - ACOL - right_fixed
     col_w = max(18, atotal_w / num_acols)
@@ -196,7 +255,7 @@ def generate_coc_pdf(data, logo_path=None):
     T(c, kx+3, hdr_top-21, "KELP Ordering ID:", fs=FS_LABEL)
     HLINE(c, kx+75, RM-6, hdr_top-23, lw=0.3)
     kid = g("kelp_ordering_id")
-    if kid: TV(c, kx+77, hdr_top-21, kid)
+    if kid: KV(c, "kelp_ordering_id", kid)
     T(c, kx+3, hdr_top-31, "COC ID: "+coc_id, fs=6.5, bold=True, color=HDR_BLUE)
 
     # CLIENT INFO - 5 rows on right, left side: company (1 row) + address (3 rows) + project (1 row)
@@ -213,7 +272,7 @@ def generate_coc_pdf(data, logo_path=None):
     y1b = y0b - rh
     R(c, LM, y1b, lw_, rh)
     T(c, LM+2, y1b+2, "Client Address:")
-    addr = g("client_address") or g("street_address")
+    addr = g("client_address")
     if addr: TV(c, LM+60, y1b+1, addr, maxw=lw_-64)
     R(c, COL2, y1b, cw_, rh)
     T(c, COL2+2, y1b+2, "Phone #:"); TV(c, COL2+35, y1b+1, g("phone"), maxw=cw_-39)
@@ -364,10 +423,9 @@ def generate_coc_pdf(data, logo_path=None):
 
     # Right side fields
     sbf_h = 19; fy = z4_top
-    for lbl,val in [("Project Mgr.:",g("project_manager")),("AcctNum / Client ID:",g("acct_num")),("Table #:",g("table_number")),("Profile / Template:",g("profile_template")),("Prelog / Bottle Ord. ID:",g("prelog_id"))]:
+    for key,lbl in SIDE_FIELDS:
         R(c,SBX,fy-sbf_h,COMMENT_W,sbf_h)
-        T(c,SBX+2,fy-sbf_h+9,lbl); lw2=stringWidth(lbl,"Helvetica",FS_LABEL)+3
-        TV(c,SBX+lw2,fy-sbf_h+9,val,fs=7,maxw=COMMENT_W-lw2-2); fy-=sbf_h
+        T(c,SBX+2,fy-sbf_h+9,lbl); KV(c,key,g(key)); fy-=sbf_h
     sc_h = fy - tall_bot; R(c, SBX, tall_bot, COMMENT_W, sc_h)
     TC(c, SBX, tall_bot+sc_h/2-3, COMMENT_W, "Sample Comment", fs=FS_HEADER, bold=True)
 
@@ -376,41 +434,35 @@ def generate_coc_pdf(data, logo_path=None):
     VTEXT(c, PNCX+PNC_W/2-4, tall_bot+6, "identified for sample.", fs=5, bold=False)
 
     # SAMPLE DATA ROWS
-    data_rh = 18; max_rows = 10; data_top = tall_bot
+    data_rh = 18; max_rows = MAX_SAMPLE_ROWS; data_top = tall_bot
     SECTION_LABEL(c, LM, data_top-sec_h, ACOL-LM, sec_h, "SAMPLE INFORMATION"); data_top -= sec_h
-    samples = d.get("samples", [])
+    samples = d.samples; blank = SampleRecord()
+    fb = "Helvetica-Bold"; row_cells = [(LM,174,"sample_id","left",FS_VALUE),(174,206,"matrix","center",FS_VALUE),(206,234,"comp_grab","center",7),(234,289,"start_date","center",7),(289,324,"start_time","center",7),(324,375,"end_date","center",7),(375,410,"end_time","center",7),(410,430,"num_containers","center",FS_VALUE),(430,452,"res_cl_result","center",7),(452,ACOL,"res_cl_units","center",FS_LEGEND)]
+    rows_bot = data_top - max_rows*data_rh
+    SHADE(c, [(LM, data_top-(ri+1)*data_rh, RM-LM, data_rh) for ri in range(1, max_rows, 2)], ROW_SHADE)
+    GRID(c, [x0 for x0,_,_,_,_ in row_cells] + AX + [SBX, PNCX, RM], [data_top - ri*data_rh for ri in range(max_rows+1)])
+    runs = []
     for ri in range(max_rows):
-        s = samples[ri] if ri < len(samples) else {}
-        ryb = data_top - (ri+1)*data_rh
-        if ri%2==1: c.setFillColor(ROW_SHADE); c.rect(LM,ryb,RM-LM,data_rh,fill=1,stroke=0)
-        c.setFont("Helvetica",5.5); c.setFillColor(black); c.drawCentredString(LM+5,ryb+8,str(ri+1))
-        for x0,x1,val,align,fs in [(LM,174,s.get("sample_id",""),"left",FS_VALUE),(174,206,s.get("matrix",""),"center",FS_VALUE),(206,234,s.get("comp_grab",""),"center",7),(234,289,s.get("start_date",""),"center",7),(289,324,s.get("start_time",""),"center",7),(324,375,s.get("end_date","") or s.get("collected_date",""),"center",7),(375,410,s.get("end_time","") or s.get("collected_time",""),"center",7),(410,430,s.get("num_containers",""),"center",FS_VALUE),(430,452,s.get("res_cl_result",""),"center",7),(452,ACOL,s.get("res_cl_units",""),"center",FS_LEGEND)]:
-            R(c,x0,ryb,x1-x0,data_rh)
-            if val:
-                if align=="center": TC(c,x0,ryb+6,x1-x0,str(val),fs=fs,bold=True)
-                else: TV(c,x0+11,ryb+6,str(val),fs=fs,maxw=x1-x0-15)
-        sa = s.get("analyses",{})
-        if isinstance(sa,list): sa = {cat:[] for cat in sa}
-        for ci2 in range(num_acols):
-            ax0=AX[ci2]; ax1=AX[ci2+1] if ci2+1<len(AX) else KSX; R(c,ax0,ryb,ax1-ax0,data_rh)
-        short_to_full = {v: k for k, v in CAT_SHORT_MAP.items()}
-        for cat_name,al in sa.items():
-            if not al: continue
-            resolved = cat_name
-            if cat_name not in cat_col_indices and cat_name in short_to_full:
-                resolved = short_to_full[cat_name]
-            if resolved not in cat_col_indices: continue
-            for ci_idx in cat_col_indices[resolved]:
-                if ci_idx < num_acols:
-                    ax0=AX[ci_idx]; ax1=AX[ci_idx+1] if ci_idx+1<len(AX) else KSX
-                    TC(c,ax0,ryb+6,ax1-ax0,"X",fs=FS_VALUE,bold=True)
-        R(c,KSX,ryb,KELP_STRIP_W,data_rh); R(c,SBX,ryb,COMMENT_W,data_rh)
-        cmt = s.get("comment","")
-        if cmt: TV(c,SBX+2,ryb+6,cmt,fs=FS_LEGEND,maxw=COMMENT_W-4)
-        R(c,PNCX,ryb,PNC_W,data_rh)
+        s = samples[ri] if ri < len(samples) else blank
+        ryb = data_top - (ri+1)*data_rh; ty = ryb + 6
+        n = str(ri+1); runs.append(("Helvetica", 5.5, LM+5-stringWidth(n,"Helvetica",5.5)/2, ryb+8, n))
+        for x0,x1,key,align,fs in row_cells:
+            val = getattr(s, key)
+            if not val: continue
+            if align=="center": runs.append((fb, fs, x0+(x1-x0)/2-stringWidth(val,fb,fs)/2, ty, val))
+            else: vs = FIT(val,fb,fs,x1-x0-15); runs.append((fb, vs, x0+11, ty, val))
+        marked = set()
+        for cat_name,_ in s.analyses:
+            marked.update(i for i in cat_col_indices.get(cat_name, ()) if i < num_acols)
+        xw = stringWidth("X",fb,FS_VALUE)
+        for ci_idx in sorted(marked):
+            runs.append((fb, FS_VALUE, (AX[ci_idx]+AX[ci_idx+1])/2-xw/2, ty, "X"))
+        cmt = s.comment
+        if cmt: runs.append((fb, FIT(cmt,fb,FS_LEGEND,COMMENT_W-4), SBX+2, ty, cmt))
+    TEXTS(c, runs)
 
     # BOTTOM ZONE
-    bot_top = data_top - max_rows*data_rh
+    bot_top = rows_bot
     SECTION_LABEL(c, LM, bot_top-sec_h, RM-LM, sec_h, "CHAIN OF CUSTODY RECORD / LABORATORY RECEIVING"); bot_top -= sec_h
     inst_h = 14; half_w = (RM-LM)/2
     R(c,LM,bot_top-inst_h,half_w,inst_h)
@@ -422,9 +474,9 @@ def generate_coc_pdf(data, logo_path=None):
 
     lr_top = bot_top - inst_h; lr_h = 10
     R(c,LM,lr_top-lr_h,RM-LM,lr_h)
-    T(c,LM+2,lr_top-9,"# Coolers:"); TV(c,LM+48,lr_top-9,g("num_coolers"),fs=7.5)
-    T(c,LM+78,lr_top-9,"Thermometer ID:"); TV(c,LM+140,lr_top-9,g("thermometer_id"),fs=7.5)
-    T(c,LM+200,lr_top-9,"Temp. (\u00b0C):"); TV(c,LM+240,lr_top-9,g("temperature"),fs=7.5)
+    T(c,LM+2,lr_top-9,"# Coolers:"); KV(c,"num_coolers",g("num_coolers"))
+    T(c,LM+78,lr_top-9,"Thermometer ID:"); KV(c,"thermometer_id",g("thermometer_id"))
+    T(c,LM+200,lr_top-9,"Temp. (\u00b0C):"); KV(c,"temperature",g("temperature"))
     roi = g("received_on_ice","Yes")
     T(c,LM+320,lr_top-9,"Sample Received on ice:")
     CB(c,LM+414,lr_top-11,checked=(roi=="Yes")); T(c,LM+423,lr_top-9,"Yes")
@@ -438,7 +490,7 @@ def generate_coc_pdf(data, logo_path=None):
         rcx=LM+rw1+dtw; R(c,rcx,ryb,rw1,rel_h); T(c,rcx+2,ryb+3,"Received by/Company: (Signature)",fs=FS_LEGEND)
         R(c,rcx+rw1,ryb,dtw,rel_h); T(c,rcx+rw1+2,ryb+3,"Date/Time:",fs=FS_LEGEND)
         rsx=rcx+rw1+dtw; rsw=RM-rsx; R(c,rsx,ryb,rsw,rel_h)
-        if row_i==0: T(c,rsx+2,ryb+3,"Tracking #:",fs=FS_LEGEND); TV(c,rsx+46,ryb+3,g("tracking_number"),fs=7,maxw=rsw-50)
+        if row_i==0: T(c,rsx+2,ryb+3,"Tracking #:",fs=FS_LEGEND); KV(c,"tracking_number",g("tracking_number"))
         elif row_i==1:
             dm=g("delivery_method"); T(c,rsx+2,ryb+3,"Delivered by:",fs=FS_LEGEND); avail=rsw-58
             for dn,dx in [("In-Person",rsx+55),("FedEx",rsx+55+avail*0.30),("UPS",rsx+55+avail*0.55),("Other",rsx+55+avail*0.75)]:
@@ -500,5 +552,6 @@ def generate_coc_pdf(data, logo_path=None):
         else: c.drawString(col2_x,cy,line); cy-=12; line=word
     if line: c.drawString(col2_x,cy,line)
     _footer(c, 2, total_pages, coc_id)
+    embed_payload(c, submitted, coc_id)
     c.showPage(); c.save(); buf.seek(0)
     return buf, coc_id
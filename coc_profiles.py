@@ -0,0 +1,231 @@
+"""
+coc_profiles.py - KELP saved analysis profiles v1
+
+- Named, versioned analyte selections stored in a local JSON file
+- Each version is kept with its compiled (package-expanded) per-category selection
+- Package definitions (what each "Packages" entry covers) are named, versioned sets in the same file
+- expand_analyses(): package expansion memoized per distinct selection
+
+Usage: python coc_profiles.py [--store FILE] packages
+       python coc_profiles.py [--store FILE] define-package NAME DEFINITION.json [--description TEXT]
+DEFINITION.json: {category: [analytes]}, reviewed by the lab before it is stored
+"""
+import argparse, datetime, functools, json, logging, os
+from dataclasses import dataclass
+
+from coc_catalog import KELP_ANALYTE_CATALOG, CATALOG_VERSION
+
+log = logging.getLogger("coc_profiles")
+
+PACKAGES = "Packages"
+DEFAULT_PATH = os.environ.get("KELP_PROFILES", "kelp_profiles.json")
+_ORDER = {cn: i for i, cn in enumerate(KELP_ANALYTE_CATALOG)}
+_KINDS = ("packages", "profiles")  # load order: profiles compile against the packages
+_active = None  # package table expand_analyses() uses; see package_table()
+
+
+def _expand(analyses, table):
+    pkgs = dict(analyses).get(PACKAGES)
+    if not pkgs: return analyses
+    merged = {}
+    for cn, al in analyses: merged.setdefault(cn, dict.fromkeys(al))
+    for p in pkgs:
+        for cn, al in table.get(p, ()): merged.setdefault(cn, {}).update(dict.fromkeys(al))
+    return tuple((cn, tuple(merged[cn])) for cn in sorted(merged, key=lambda cn: _ORDER.get(cn, len(_ORDER))))
+
+
+@functools.lru_cache(maxsize=1024)
+def expand_analyses(analyses):
+    """SampleRecord.analyses with every selected package's analytes merged into their
+    categories (catalog order; explicit picks first, no duplicates). The Packages entry
+    is kept so the COC still shows what was ordered. Packages without a stored
+    definition pass through unexpanded."""
+    return _expand(analyses, package_table())
+
+
+def package_table():
+    """Active package definitions {package: ((category, (analytes...)), ...)}: the table
+    last passed to use_packages(), else the latest versions in the store at DEFAULT_PATH
+    (KELP_PROFILES), read once per process."""
+    if _active is None: use_packages(ProfileStore(DEFAULT_PATH, readonly=True).package_table())
+    return _active
+
+
+def use_packages(table):
+    """Make table the package definitions expand_analyses() uses."""
+    global _active
+    if table is not _active: _active = table; expand_analyses.cache_clear()
+
+
+def compile_selection(selection, packages=None):
+    """{category: [analytes]} -> expanded analyses tuple; rejects names not in the catalog.
+    packages: package table to expand with (default: package_table())."""
+    analyses = []
+    for cn, al in selection.items():
+        if cn not in KELP_ANALYTE_CATALOG: raise ValueError("unknown analysis category %r" % cn)
+        bad = [a for a in al if a not in KELP_ANALYTE_CATALOG[cn]["analytes"]]
+        if bad: raise ValueError("%s not in %s" % (", ".join(bad), cn))
+        if al: analyses.append((cn, tuple(dict.fromkeys(al))))
+    if packages is None: return expand_analyses(tuple(analyses))
+    return _expand(tuple(analyses), packages)
+
+
+def compile_package(name, definition):
+    """One package's {category: [analytes]} -> ((category, (analytes...)), ...) in catalog order.
+    ValueError unless name is a catalog package and the definition names catalog analytes only."""
+    if name not in KELP_ANALYTE_CATALOG[PACKAGES]["analytes"]: raise ValueError("package %r is not in the catalog" % name)
+    if PACKAGES in definition: raise ValueError("package %r cannot contain packages" % name)
+    compiled = compile_selection(definition, {})
+    if not compiled: raise ValueError("package %r selects no analytes" % name)
+    return tuple(sorted(compiled, key=lambda c: _ORDER[c[0]]))
+
+
+def _ver(v):
+    """Version number of a raw stored version, or None if unreadable."""
+    n = v.get("version") if isinstance(v, dict) else None
+    return n if isinstance(n, int) else None
+
+
+@dataclass(frozen=True, slots=True)
+class Profile:
+    name: str
+    version: int
+    selection: tuple  # as saved: ((category, (analytes...)), ...), packages unexpanded
+    analyses: tuple   # compiled: same shape, packages expanded
+    description: str = ""
+    created: str = ""
+
+    @property
+    def label(self):
+        """Text for the COC's Profile / Template field."""
+        return "%s v%d" % (self.name, self.version)
+
+    def selection_dict(self, compiled=True):
+        return {cn: list(al) for cn, al in (self.analyses if compiled else self.selection)}
+
+
+class ProfileStore:
+    """Profiles and package definitions in one JSON file:
+    {"catalog_version", "packages": {name: [version, ...]}, "profiles": {name: [version, ...]}}.
+    Saving never overwrites: each save appends a new version. A package's latest
+    version is the one in use. Compiled profile selections are stored alongside and
+    rebuilt on load only if the catalog version changed; saving a package rebuilds them.
+
+    A version that no longer compiles (e.g. an analyte dropped from the catalog)
+    is left out of names()/get(), listed in .invalid and written back marked
+    "invalid", so it is retried on every load instead of trusted.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, readonly=False):
+        self.path = path; self.readonly = readonly
+        self._items = {k: {} for k in _KINDS}  # kind -> name -> [Profile]
+        self._bad = {k: {} for k in _KINDS}    # kind -> name -> raw version dicts that failed to load
+        self.invalid = []   # (name, version, reason)
+        self._table = {}
+        doc = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f: doc = json.load(f)
+        stale = doc.get("catalog_version") != CATALOG_VERSION
+        dirty = stale and bool(doc)
+        for kind in _KINDS:
+            for name, versions in doc.get(kind, {}).items():
+                good = self._items[kind].setdefault(name, [])
+                for v in versions:
+                    try: good.append(self._load(kind, name, v, stale or "invalid" in v)); dirty |= "invalid" in v
+                    except (ValueError, KeyError, TypeError, AttributeError) as e:
+                        log.warning("skipping %s %r v%s: %s", kind[:-1], name, _ver(v), e)
+                        self.invalid.append((name, _ver(v), str(e)))
+                        self._bad[kind].setdefault(name, []).append(dict(v, invalid=str(e)) if isinstance(v, dict) else v)
+            if kind == "packages": self._table = self._build_table()
+        if dirty and not readonly: self._write()
+
+    def _load(self, kind, name, v, recompile):
+        sel = tuple((cn, tuple(al)) for cn, al in v["selection"].items())
+        if kind == "packages": compiled = compile_package(name, v["selection"])
+        elif recompile: compiled = compile_selection(v["selection"], self._table)
+        else: compiled = tuple((cn, tuple(al)) for cn, al in v["compiled"].items())
+        return Profile(name, v["version"], sel, compiled, v.get("description", ""), v.get("created", ""))
+
+    def _build_table(self):
+        return {n: vs[-1].analyses for n, vs in self._items["packages"].items() if vs}
+
+    def _write(self):
+        doc = {"catalog_version": CATALOG_VERSION}
+        for kind in _KINDS:
+            items, bad = self._items[kind], self._bad[kind]; out = doc[kind] = {}
+            for name in dict.fromkeys([*items, *bad]):
+                vs = [{"version": p.version, "created": p.created, "description": p.description,
+                       "selection": p.selection_dict(False), "compiled": p.selection_dict()} for p in items.get(name, ())]
+                out[name] = sorted(vs + bad.get(name, []), key=lambda v: _ver(v) or 0)
+        tmp = self.path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(doc, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def names(self, kind="profiles"):
+        return sorted(n for n, vs in self._items[kind].items() if vs)
+
+    def versions(self, name, kind="profiles"):
+        return [p.version for p in self._items[kind].get(name, ())]
+
+    def get(self, name, version=None, kind="profiles"):
+        """Latest (or a specific) version of a profile or package; KeyError if absent."""
+        versions = self._items[kind].get(name)
+        if not versions: raise KeyError(name)
+        if version is None: return versions[-1]
+        for p in versions:
+            if p.version == version: return p
+        raise KeyError("%s v%s" % (name, version))
+
+    def package_table(self):
+        """{package: ((category, (analytes...)), ...)} from each package's latest version.
+        The same object until a package is saved, so callers can pass it to use_packages() freely."""
+        return self._table
+
+    def _append(self, kind, name, selection, compiled, description):
+        if self.readonly: raise ValueError("profile store %s is read-only" % self.path)
+        versions = self._items[kind].setdefault(name, [])
+        taken = [p.version for p in versions] + [_ver(v) or 0 for v in self._bad[kind].get(name, ())]
+        p = Profile(name, max(taken, default=0) + 1,
+                    tuple((cn, tuple(dict.fromkeys(al))) for cn, al in selection.items() if al), compiled,
+                    description, datetime.datetime.now().isoformat(timespec="seconds"))
+        versions.append(p)
+        return p
+
+    def save(self, name, selection, description=""):
+        """Store selection ({category: [analytes]}) as the next version of name."""
+        name = name.strip()
+        if not name: raise ValueError("profile name is required")
+        compiled = compile_selection(selection, self._table)
+        if not compiled: raise ValueError("profile %r selects no analytes" % name)
+        p = self._append("profiles", name, selection, compiled, description); self._write()
+        return p
+
+    def save_package(self, name, definition, description=""):
+        """Store definition ({category: [analytes]}) as the next version of a catalog
+        package; it becomes the definition in use, and every profile is recompiled."""
+        p = self._append("packages", name, definition, compile_package(name, definition), description)
+        self._table = self._build_table()
+        for vs in self._items["profiles"].values():
+            vs[:] = [Profile(q.name, q.version, q.selection, compile_selection(q.selection_dict(False), self._table),
+                             q.description, q.created) for q in vs]
+        self._write()
+        return p
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="KELP analysis profiles and package definitions.")
+    ap.add_argument("--store", default=DEFAULT_PATH); sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("packages")
+    d = sub.add_parser("define-package"); d.add_argument("name"); d.add_argument("definition")
+    d.add_argument("--description", default="")
+    a = ap.parse_args()
+    store = ProfileStore(a.store)
+    if a.cmd == "packages":
+        for n in store.names("packages"):
+            p = store.get(n, kind="packages")
+            print(json.dumps({"package": p.label, "created": p.created, "description": p.description,
+                              "analytes": p.selection_dict()}, separators=(",", ":")))
+    else:
+        with open(a.definition, encoding="utf-8") as f: definition = json.load(f)
+        try: print("stored " + store.save_package(a.name, definition, a.description).label)
+        except ValueError as e: ap.error(str(e))
@@ -0,0 +1,174 @@
+"""
+coc_records.py - Typed COC records v1
+
+- Frozen, slotted COCRecord / SampleRecord (no per-instance __dict__)
+- from_dict(): one pass that normalizes loose coc_data and collects every problem
+- Categories resolved to full catalog names; repeated short strings interned
+"""
+import datetime, functools, sys
+from dataclasses import dataclass, fields
+
+from coc_catalog import KELP_ANALYTE_CATALOG, CAT_SHORT_MAP, POTABLE_MATRICES, NONPOTABLE_MATRICES
+
+TIME_ZONES = ("AK", "PT", "MT", "CT", "ET")
+COMP_GRAB = ("GRAB", "COMP")
+MATRICES = POTABLE_MATRICES | NONPOTABLE_MATRICES
+
+_SHORT_TO_FULL = {v: k for k, v in CAT_SHORT_MAP.items()}
+_ANALYTES = {cn: frozenset(info["analytes"]) for cn, info in KELP_ANALYTE_CATALOG.items()}
+_intern = sys.intern
+
+
+class COCValidationError(ValueError):
+    """Raised by from_dict() with every problem found in the record."""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("; ".join(self.problems))
+
+
+def _s(v):
+    return "" if v is None else str(v).strip()
+
+@functools.lru_cache(maxsize=4096)
+def _valid_dt(val, fmt):
+    """strptime check, memoized: a batch of COCs repeats the same few dates and times."""
+    try: datetime.datetime.strptime(val, fmt); return True
+    except ValueError: return False
+
+def _check_dt(val, fmt, what, problems):
+    if val and not _valid_dt(val, fmt): problems.append("%s %r is not %s" % (what, val, fmt.replace("%", "")))
+
+
+@dataclass(frozen=True, slots=True)
+class SampleRecord:
+    sample_id: str = ""
+    matrix: str = ""
+    comp_grab: str = ""
+    start_date: str = ""
+    start_time: str = ""
+    end_date: str = ""
+    end_time: str = ""
+    num_containers: str = ""
+    res_cl_result: str = ""
+    res_cl_units: str = ""
+    comment: str = ""
+    analyses: tuple = ()  # ((full category name, (analyte, ...)), ...), empty categories dropped
+
+    @classmethod
+    def from_dict(cls, d, problems, where="sample"):
+        """Normalize one sample dict, appending problems instead of raising."""
+        if not isinstance(d, dict):
+            problems.append(where + " is not an object"); return None
+        matrix = _s(d.get("matrix")).upper(); cg = _s(d.get("comp_grab")).upper()
+        if matrix and matrix not in MATRICES: problems.append("%s: unknown matrix %r" % (where, matrix))
+        if cg and cg not in COMP_GRAB: problems.append("%s: comp_grab must be GRAB or COMP, got %r" % (where, cg))
+        end_date = _s(d.get("end_date")) or _s(d.get("collected_date"))
+        end_time = _s(d.get("end_time")) or _s(d.get("collected_time"))
+        start_date = _s(d.get("start_date")); start_time = _s(d.get("start_time"))
+        for val, fmt, what in ((start_date, "%m/%d/%Y", "start_date"), (end_date, "%m/%d/%Y", "end_date"),
+                               (start_time, "%H:%M", "start_time"), (end_time, "%H:%M", "end_time")):
+            _check_dt(val, fmt, where + ": " + what, problems)
+        sa = d.get("analyses") or {}
+        if isinstance(sa, (list, tuple)): sa = {}  # category-only lists carry no analytes to mark
+        if not isinstance(sa, dict):
+            problems.append(where + ": analyses must be a mapping of category -> analytes"); sa = {}
+        analyses = []
+        for cn, al in sa.items():
+            if not al: continue
+            cat = cn if cn in KELP_ANALYTE_CATALOG else _SHORT_TO_FULL.get(cn)
+            if cat is None: problems.append("%s: unknown analysis category %r" % (where, cn)); continue
+            if not isinstance(al, (list, tuple)) or not all(isinstance(a, str) for a in al):
+                problems.append("%s: analytes for %s must be a list of names" % (where, cat)); continue
+            bad = [a for a in al if a not in _ANALYTES[cat]]
+            if bad: problems.append("%s: %s not in %s" % (where, ", ".join(map(repr, bad)), cat)); continue
+            analyses.append((_intern(cat), tuple(dict.fromkeys(_intern(a) for a in al))))
+        return cls(_s(d.get("sample_id")), _intern(matrix), _intern(cg), start_date, start_time,
+                   end_date, end_time, _s(d.get("num_containers")), _s(d.get("res_cl_result")),
+                   _s(d.get("res_cl_units")), _s(d.get("comment")), tuple(analyses))
+
+    def to_dict(self):
+        """Compact dict: empty fields omitted, analyses as {category: [analytes]}."""
+        out = {f.name: getattr(self, f.name) for f in fields(self) if f.name != "analyses" and getattr(self, f.name)}
+        out["analyses"] = {cat: list(al) for cat, al in self.analyses}
+        return out
+
+
+@dataclass(frozen=True, slots=True)
+class COCRecord:
+    coc_id: str = ""
+    company_name: str = ""
+    client_address: str = ""
+    client_address_2: str = ""
+    client_address_3: str = ""
+    contact_name: str = ""
+    phone: str = ""
+    email: str = ""
+    cc_email: str = ""
+    project_number: str = ""
+    project_name: str = ""
+    invoice_to: str = ""
+    invoice_email: str = ""
+    site_info: str = ""
+    county_state: str = ""
+    purchase_order: str = ""
+    quote_number: str = ""
+    container_size: str = ""
+    preservative_type: str = ""
+    time_zone: str = "PT"
+    data_deliverable: str = "Level I (Std)"
+    field_filtered: str = "No"
+    reportable: str = ""
+    rush: str = "Standard (5-10 Day)"
+    received_on_ice: str = "Yes"
+    delivery_method: str = ""
+    additional_instructions: str = ""
+    customer_remarks: str = ""
+    # KELP use only
+    kelp_ordering_id: str = ""
+    project_manager: str = ""
+    acct_num: str = ""
+    table_number: str = ""
+    profile_template: str = ""
+    prelog_id: str = ""
+    num_coolers: str = ""
+    thermometer_id: str = ""
+    temperature: str = ""
+    tracking_number: str = ""
+    samples: tuple = ()
+
+    @classmethod
+    def from_dict(cls, d):
+        """Validate and normalize loose coc_data in a single pass.
+
+        Missing/blank fields take the form defaults; client_address falls back
+        to street_address and end_date/end_time to collected_date/collected_time.
+        Raises COCValidationError listing every problem found.
+        """
+        if isinstance(d, cls): return d
+        if not isinstance(d, dict): raise COCValidationError(["coc_data must be an object"])
+        problems = []; kw = {}
+        for f in fields(cls):
+            if f.name == "samples": continue
+            v = _s(d.get(f.name))
+            if v: kw[f.name] = v
+        if "client_address" not in kw and _s(d.get("street_address")): kw["client_address"] = _s(d.get("street_address"))
+        tz = kw.get("time_zone", "PT").upper()
+        if tz not in TIME_ZONES: problems.append("unknown time_zone %r" % tz)
+        kw["time_zone"] = _intern(tz)
+        raw = d.get("samples") or []
+        if not isinstance(raw, (list, tuple)): problems.append("samples must be a list"); raw = []
+        samples = tuple(SampleRecord.from_dict(s, problems, "sample %d" % (i+1)) for i, s in enumerate(raw))
+        if problems: raise COCValidationError(problems)
+        return cls(samples=samples, **kw)
+
+    def to_dict(self):
+        """Compact dict for storage/embedding: empty fields omitted."""
+        out = {f.name: getattr(self, f.name) for f in fields(self) if f.name != "samples" and getattr(self, f.name)}
+        out["samples"] = [s.to_dict() for s in self.samples]
+        return out
+
+
+def as_record(data):
+    """COCRecord for either a record or a loose coc_data dict."""
+    return data if isinstance(data, COCRecord) else COCRecord.from_dict(data)
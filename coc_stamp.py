@@ -0,0 +1,211 @@
+"""
+coc_stamp.py - KELP receiving-field stamper v1
+
+- Stamps KELP-use receiving fields onto an already-issued COC PDF
+- Appends an incremental PDF update; the original bytes are never rewritten
+- One content stream at the fixed page-1 field slots, drawn with the page's own Helvetica-Bold
+- Fields already filled in (at issue or by an earlier stamp) are refused unless overwritten
+"""
+import mmap, os, re, zlib
+
+from coc_payload import extract_payload
+from coc_pdf_engine import KELP_FIELD_SLOTS, FIT
+
+RECEIVING_FIELDS = ["kelp_ordering_id", "project_manager", "acct_num", "prelog_id",
+                    "num_coolers", "thermometer_id", "temperature", "tracking_number"]
+
+_REF = rb"(\d+)\s+(\d+)\s+R"
+_STARTXREF_RE = re.compile(rb"startxref\s+(\d+)")
+_XREF_ENTRY_RE = re.compile(rb"(\d{10}) (\d{5}) ([nf])")
+_STAMPED_RE = re.compile(rb"/KELPStamped\s*\[([^\]]*)\]")
+
+
+def _esc(t):
+    return t.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+def _num(v):
+    return ("%.2f" % v).rstrip("0").rstrip(".")
+
+
+def _find(buf, sub, start):
+    i = buf.find(sub, start)
+    if i < 0: raise ValueError("malformed PDF: %r not found" % sub)
+    return i
+
+
+def _dict_end(buf, i):
+    """Index just past the '>>' closing the dictionary that opens at buf[i:i+2] == b'<<'."""
+    depth = 0; n = len(buf)
+    while i < n:
+        two = buf[i:i+2]
+        if two == b"<<": depth += 1; i += 2; continue
+        if two == b">>":
+            depth -= 1; i += 2
+            if depth == 0: return i
+            continue
+        if buf[i:i+1] == b"(":
+            pd = 0
+            while i < n:
+                ch = buf[i:i+1]
+                if ch == b"\\": i += 2; continue
+                if ch == b"(": pd += 1
+                elif ch == b")":
+                    pd -= 1
+                    if pd == 0: break
+                i += 1
+        i += 1
+    raise ValueError("unterminated PDF dictionary")
+
+
+def _value_span(d, key):
+    """(start, end) of the value following /key in dictionary text d, or None."""
+    m = re.search(rb"/" + key + rb"(?![A-Za-z0-9])\s*", d)
+    if not m: return None
+    i = m.end()
+    if d[i:i+2] == b"<<": return i, _dict_end(d, i)
+    if d[i:i+1] == b"[": return i, d.index(b"]", i) + 1
+    r = re.match(_REF + rb"|/?[^\s/<>\[\]]+", d[i:])
+    return i, i + r.end()
+
+
+class _Reader:
+    """Minimal reader for classic-xref PDFs (as written by reportlab), following /Prev chains."""
+
+    def __init__(self, buf):
+        self.buf = buf; self.offsets = {}
+        tail = buf[max(0, len(buf)-1024):]
+        m = None
+        for m in _STARTXREF_RE.finditer(tail): pass
+        if not m: raise ValueError("no startxref found; not a PDF?")
+        self.startxref = pos = int(m.group(1)); self.trailer = None
+        while pos is not None:
+            if buf[pos:pos+4] != b"xref": raise ValueError("cross-reference streams are not supported")
+            tp = _find(buf, b"trailer", pos)
+            lines = buf[pos+4:tp].split(b"\n"); objnum = 0
+            for ln in lines:
+                ln = ln.strip()
+                if not ln: continue
+                e = _XREF_ENTRY_RE.match(ln)
+                if e:
+                    if e.group(3) == b"n" and objnum not in self.offsets:
+                        self.offsets[objnum] = (int(e.group(1)), int(e.group(2)))
+                    objnum += 1
+                else: objnum = int(ln.split()[0])
+            ds = _find(buf, b"<<", tp); trailer = buf[ds:_dict_end(buf, ds)]
+            if self.trailer is None: self.trailer = trailer
+            prev = re.search(rb"/Prev\s+(\d+)", trailer)
+            pos = int(prev.group(1)) if prev else None
+
+    def obj(self, num):
+        """(generation, dictionary text) of object num."""
+        off, gen = self.offsets[num]
+        ds = _find(self.buf, b"<<", off)
+        return gen, self.buf[ds:_dict_end(self.buf, ds)]
+
+    def ref(self, d, key):
+        sp = _value_span(d, key)
+        m = sp and re.match(_REF, d[sp[0]:sp[1]])
+        if not m: raise ValueError("missing /%s reference" % key.decode())
+        return int(m.group(1))
+
+    def first_page(self):
+        root = self.ref(self.trailer, b"Root")
+        num = self.ref(self.obj(root)[1], b"Pages")
+        while True:
+            d = self.obj(num)[1]
+            if re.search(rb"/Type\s*/Page(?![s])", d): return num
+            ks = _value_span(d, b"Kids")
+            num = int(re.search(_REF, d[ks[0]:ks[1]]).group(1))
+
+
+def _bold_font(rd, res):
+    """Resource name of the page's Helvetica-Bold font (the engine registers it as /F2)."""
+    fs = _value_span(res, b"Font")
+    fd = res[fs[0]:fs[1]] if fs else b""
+    if fd and not fd.startswith(b"<<"): fd = rd.obj(int(re.match(_REF, fd).group(1)))[1]
+    for m in re.finditer(rb"/([^\s/<>\[\]()]+)\s*" + _REF, fd):
+        if re.search(rb"/BaseFont\s*/Helvetica-Bold(?![A-Za-z-])", rd.obj(int(m.group(2)))[1]): return m.group(1)
+    raise ValueError("page 1 has no Helvetica-Bold font resource; not a KELP COC?")
+
+
+def filled_fields(pdf):
+    """Receiving fields that already hold a value: filled in when the COC was issued
+    (embedded payload) or stamped by an earlier update."""
+    p = extract_payload(pdf); data = p.get("data") if isinstance(p, dict) else None
+    done = {k for k in RECEIVING_FIELDS if isinstance(data, dict) and data.get(k)}
+    for m in _STAMPED_RE.finditer(pdf): done.update(n.decode() for n in re.findall(rb"/(\w+)", m.group(1)))
+    return done
+
+
+def _overlay(font, values, cover):
+    """Page content drawing values; slots in cover are painted white first."""
+    ops = [b"Q"]
+    for key in RECEIVING_FIELDS:
+        val = values.get(key)
+        if val in (None, ""): continue
+        x, y, fs, maxw = KELP_FIELD_SLOTS[key]; t = str(val)
+        if key in cover: ops.append(("1 g %s %s %s %s re f" % (_num(x-1), _num(y-2), _num(maxw+2), _num(fs+3))).encode())
+        s = FIT(t, "Helvetica-Bold", fs, maxw)
+        ops.append(("0 g BT /%s %s Tf %s %s Td (" % (font.decode(), _num(s), _num(x), _num(y))).encode()
+                   + _esc(t.encode("cp1252", "replace")) + b") Tj ET")
+    return b"\n".join(ops) + b"\n"
+
+
+def build_stamp_update(pdf, values, overwrite=False):
+    """Return the incremental-update bytes that stamp values onto page 1 of pdf (bytes or mmap).
+    A field that already holds a value (see filled_fields) is refused with ValueError
+    unless overwrite, which paints the old value out under the new one; the issued
+    bytes, and so the old value, stay in the file."""
+    values = {k: v for k, v in values.items() if v not in (None, "")}
+    unknown = set(values) - set(RECEIVING_FIELDS)
+    if unknown: raise ValueError("not a KELP receiving field: " + ", ".join(sorted(unknown)))
+    filled = filled_fields(pdf) & set(values)
+    if filled and not overwrite:
+        raise ValueError("already filled in on this COC: %s (pass overwrite to replace)" % ", ".join(sorted(filled)))
+    rd = _Reader(pdf)
+    size = int(re.search(rb"/Size\s+(\d+)", rd.trailer).group(1))
+    page = rd.first_page(); gen, pd = rd.obj(page)
+    n_open, n_stamp = size, size+1
+
+    # Resources: draw with the page's own Helvetica-Bold; nothing is added to them
+    rs = _value_span(pd, b"Resources"); res = pd[rs[0]:rs[1]]
+    if not res.startswith(b"<<"): res = rd.obj(int(re.match(_REF, res).group(1)))[1]
+    font = _bold_font(rd, res)
+
+    # Contents: wrap the original page content in q/Q, then draw the stamp
+    cs = _value_span(pd, b"Contents"); old = pd[cs[0]:cs[1]]
+    inner = old[1:-1].strip() if old.startswith(b"[") else old
+    pd = pd[:cs[0]] + b"[ %d 0 R %s %d 0 R ]" % (n_open, inner, n_stamp) + pd[cs[1]:]
+
+    body = _overlay(font, values, filled); z = zlib.compress(body, 9)
+    fields = b" ".join(b"/" + k.encode() for k in RECEIVING_FIELDS if k in values)
+    stamp = b"<< /KELPStamped [ %s ]" % fields + (b" /Filter /FlateDecode" if len(z) < len(body) else b"") + \
+        b" /Length %d >>\nstream\n" % min(len(z), len(body)) + (z if len(z) < len(body) else body) + b"\nendstream"
+    objs = [(page, gen, pd), (n_open, 0, b"<< /Length 1 >>\nstream\nq\nendstream"), (n_stamp, 0, stamp)]
+
+    out = bytearray(b"" if pdf[-1:] in (b"\n", b"\r") else b"\n"); base = len(pdf); offs = {}
+    for num, g, body in objs:
+        offs[num] = (base + len(out), g)
+        out += b"%d %d obj\n" % (num, g) + body + b"\nendobj\n"
+    xref = base + len(out)
+    out += b"xref\n0 1\n0000000000 65535 f \n%d 1\n%010d %05d n \n" % (page, offs[page][0], gen)
+    out += b"%d 2\n" % n_open + b"".join(b"%010d 00000 n \n" % offs[n][0] for n in (n_open, n_stamp))
+    keep = b"".join(b" /%s %s" % (k, rd.trailer[sp[0]:sp[1]]) for k in (b"Root", b"Info", b"ID")
+                    for sp in [_value_span(rd.trailer, k)] if sp)
+    out += b"trailer\n<< /Size %d /Prev %d%s >>\nstartxref\n%d\n%%%%EOF\n" % (n_stamp+1, rd.startxref, keep, xref)
+    return bytes(out)
+
+
+def stamp_receiving_fields(path, values, overwrite=False):
+    """Append a stamp for values to the COC PDF at path in place. Returns bytes appended."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: raise ValueError("empty file: " + str(path))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            upd = build_stamp_update(mm, values, overwrite)
+    with open(path, "ab") as f: f.write(upd)
+    return len(upd)
+
+
+def stamp_bytes(pdf, values, overwrite=False):
+    """Return pdf (bytes) with the stamp update appended."""
+    return bytes(pdf) + build_stamp_update(pdf, values, overwrite)